@@ -4,6 +4,20 @@
 #  network with the dragonfly topology.
 #
 
+from __future__ import print_function
+import os
+import sys
+import csv
+import json
+import heapq
+import hashlib
+import argparse
+import itertools
+from array import array
+import numpy as np
+import phase_profile
+import topology
+
 _TILES_PER_ROUTER  = 48 - 8 # 48 ports per router, but eight are used for NICs
 _SLOTS_PER_CHASSIS = 16     # each slot always has one router
 _CHASSIS_PER_GROUP = 6      # a group is two cabinets (three chassis each)
@@ -11,74 +25,151 @@ _GROUPS_PER_SYSTEM = 2      # Cori Phase I has five groups (ten cabinets)
 _RANK1_LPC = 1              # links per connection
 _RANK2_LPC = 3              # each rank2 connection has three links
 _RANK3_LPC = 1              # rank3 depends on the total number of groups
+_NODES_PER_ROUTER = 4       # compute nodes attached to each router's NICs
 
 
-def build_dragonfly():
+def get_dragonfly_params( **overrides ):
+    """
+    Returns the parameters describing the shape of a dragonfly system: the
+    module defaults above, with any keyword arguments replacing them.  Raises
+    ValueError unless every parameter is a positive integer and each router
+    has enough tiles for its rank-1 and rank-2 links, plus one rank-3
+    connection when there is more than one group
+    """
+    params = {
+        'tiles_per_router':     _TILES_PER_ROUTER,
+        'slots_per_chassis':    _SLOTS_PER_CHASSIS,
+        'chassis_per_group':    _CHASSIS_PER_GROUP,
+        'groups_per_system':    _GROUPS_PER_SYSTEM,
+        'rank1_lpc':            _RANK1_LPC,
+        'rank2_lpc':            _RANK2_LPC,
+        'rank3_lpc':            _RANK3_LPC,
+    }
+    for key in overrides:
+        if key not in params:
+            raise KeyError('unknown dragonfly parameter %s' % key)
+    params.update(overrides)
+
+    for key in sorted(params):
+        value = params[key]
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError('%s must be a positive integer, not %r'
+                % ( key.replace('_', ' '), value ))
+    ports = ( params['rank1_lpc'] * (params['slots_per_chassis'] - 1)
+            + params['rank2_lpc'] * (params['chassis_per_group'] - 1) )
+    if params['groups_per_system'] > 1:
+        ports += params['rank3_lpc']
+    if params['tiles_per_router'] < ports:
+        raise ValueError('%d tiles per router is too few: rank-1 and rank-2 '
+            'links%s need %d' % ( params['tiles_per_router'],
+            ' and one rank-3 connection' if params['groups_per_system'] > 1
+            else '', ports ))
+    return params
+
+def build_dragonfly( params=None ):
     """
     Builds a three-rank dragonfly network and returns a list of tuples 
     describing the connectivity
     """
     connections = [] # ( end1, end2, rank )
+    for end1, end2, rank, links in iter_dragonfly( params ):
+        connections.extend( [ (end1, end2, rank) ] * links )
+    return connections
+
+def iter_dragonfly( params=None ):
+    """
+    Generates the links of a three-rank dragonfly network as ( end1, end2,
+    rank, links ) tuples, where links is the number of parallel links between
+    the two routers.  All rank-1 connections come first, then rank-2, then
+    rank-3, so that writers can stream them out one rank at a time.  Only the
+    rank-3 links are held in memory, to merge repeated router pairs.  The
+    shape of the system comes from params (see get_dragonfly_params).
+    """
+    if params is None:
+        params = get_dragonfly_params()
+    tiles_per_router = params['tiles_per_router']
+    slots_per_chassis = params['slots_per_chassis']
+    chassis_per_group = params['chassis_per_group']
+    groups_per_system = params['groups_per_system']
+    rank1_lpc = params['rank1_lpc']
+    rank2_lpc = params['rank2_lpc']
+    rank3_lpc = params['rank3_lpc']
 
     ### Initialize all Aries router port counts
     router_ports = []
-    for group in range(_GROUPS_PER_SYSTEM):
+    for group in range(groups_per_system):
         router_ports.append({})
-        for chassis in range(_CHASSIS_PER_GROUP):
-            for slot in range(_SLOTS_PER_CHASSIS):
+        for chassis in range(chassis_per_group):
+            for slot in range(slots_per_chassis):
                 router_ports[-1][slotname(group,chassis,slot)] = 0
 
-    ### Link together the rank-1 and rank-2 networks (intra-group) network
-    for group in range(_GROUPS_PER_SYSTEM):
-        chassis_in_group = range(_CHASSIS_PER_GROUP)
-        ### Rank 1 (intra-chassis) network - every slot's router is connected
-        ### to every other router within the chassis
-        for chassis in chassis_in_group:
-            for slot in range(_SLOTS_PER_CHASSIS)[:-1]:
-                for otherslot in range(slot+1, _SLOTS_PER_CHASSIS):
+    ### Rank 1 (intra-chassis) network - every slot's router is connected
+    ### to every other router within the chassis
+    for group in range(groups_per_system):
+        for chassis in range(chassis_per_group):
+            for slot in range(slots_per_chassis)[:-1]:
+                for otherslot in range(slot+1, slots_per_chassis):
                     end1 = slotname(group,chassis,slot)
                     end2 = slotname(group, chassis, otherslot)
-                    for i in range(_RANK1_LPC):
-                        connections.append( (end1, end2, 1) )
-                    router_ports[group][end1] += _RANK1_LPC
-                    router_ports[group][end2] += _RANK1_LPC
-        ### Rank 2 (intra-group) network - every router is connected to a router
-        ## in the same slot in every other chassis within the group
-        for chassis in chassis_in_group[:-1]:
-            for otherchassis in range(chassis+1, _CHASSIS_PER_GROUP):
-                for slot in range(_SLOTS_PER_CHASSIS):
+                    yield ( end1, end2, 1, rank1_lpc )
+                    router_ports[group][end1] += rank1_lpc
+                    router_ports[group][end2] += rank1_lpc
+
+    ### Rank 2 (intra-group) network - every router is connected to a router
+    ## in the same slot in every other chassis within the group
+    for group in range(groups_per_system):
+        for chassis in range(chassis_per_group)[:-1]:
+            for otherchassis in range(chassis+1, chassis_per_group):
+                for slot in range(slots_per_chassis):
                     end1 = slotname(group,chassis,slot)
                     end2 = slotname(group, otherchassis, slot)
-                    for i in range(_RANK2_LPC):
-                        connections.append( (end1, end2, 2) )
-                    router_ports[group][end1] += _RANK2_LPC
-                    router_ports[group][end2] += _RANK2_LPC
+                    yield ( end1, end2, 2, rank2_lpc )
+                    router_ports[group][end1] += rank2_lpc
+                    router_ports[group][end2] += rank2_lpc
 
     ### Rank 3 (inter-group) network - Every group connects to every other
     ### group.  These connections use up whatever ports remain available on the
-    ### groups' routers.
+    ### groups' routers.  Each group keeps a heap of ( ports used, router
+    ### order, router ) so the least-connected router, first in slot order on
+    ### ties, is found without scanning the whole group for every link.
+    port_heaps = []
+    for group in range(groups_per_system):
+        port_heaps.append([])
+        for chassis in range(chassis_per_group):
+            for slot in range(slots_per_chassis):
+                end = slotname(group,chassis,slot)
+                port_heaps[-1].append( ( router_ports[group][end],
+                                         len(port_heaps[-1]), end ) )
+        heapq.heapify(port_heaps[-1])
+
     group_connectivity = {}
+    rank3_links = {}    # ( end1, end2 ) -> links, in order of first use
+    rank3_order = []
     finished = False
     while not finished:
-        if _GROUPS_PER_SYSTEM < 2: ### no rank-3 network at all
+        if groups_per_system < 2: ### no rank-3 network at all
             break
-        for group in range(_GROUPS_PER_SYSTEM)[:-1]:
+        for group in range(groups_per_system)[:-1]:
             if finished: break
-            for othergroup in range(group+1,_GROUPS_PER_SYSTEM):
-                ### Find a router with a free port.  Use min() to balance the
+            for othergroup in range(group+1,groups_per_system):
+                ### Find a router with a free port in each group, balancing the
                 ### connectivity of each router within each group.
-                end1 = min(router_ports[group],      key=router_ports[group].get)
-                end2 = min(router_ports[othergroup], key=router_ports[othergroup].get)
+                ports1, order1, end1 = port_heaps[group][0]
+                ports2, order2, end2 = port_heaps[othergroup][0]
 
                 ### If any router runs out of ports, we can't expand the Rank 3
                 ### network any further
-                if ( router_ports[group][end1]      >= _TILES_PER_ROUTER 
-                or   router_ports[othergroup][end2] >= _TILES_PER_ROUTER ):
+                if ( ports1 >= tiles_per_router
+                or   ports2 >= tiles_per_router ):
                     finished = True
                     break
 
-                router_ports[group][end1] += _RANK3_LPC
-                router_ports[othergroup][end2] += _RANK3_LPC
+                heapq.heapreplace( port_heaps[group],
+                    ( ports1 + rank3_lpc, order1, end1 ) )
+                heapq.heapreplace( port_heaps[othergroup],
+                    ( ports2 + rank3_lpc, order2, end2 ) )
+                router_ports[group][end1] += rank3_lpc
+                router_ports[othergroup][end2] += rank3_lpc
                 if end1 < end2:
                     group_pair_key = "%s=%s" % ( end1, end2 )
                 else:
@@ -86,51 +177,707 @@ def build_dragonfly():
 
                 group_connectivity[group_pair_key] = group_connectivity.get(group_pair_key, 0) + 1
 
-                for i in range(_RANK3_LPC):
-                    connections.append( (end1, end2, 3) )
+                if (end1, end2) not in rank3_links:
+                    rank3_links[(end1, end2)] = 0
+                    rank3_order.append( (end1, end2) )
+                rank3_links[(end1, end2)] += rank3_lpc
 
-    return connections
+    for end1, end2 in rank3_order:
+        yield ( end1, end2, 3, rank3_links[(end1, end2)] )
 
 def slotname( group, chassis, slot ):
     return "%d-%d-%d" % ( group, chassis, slot )
 
 
-def print_router_population():
-    for group_pairs, links in group_connectivity.iteritems():
+def router_names( params=None ):
+    """
+    Returns the name of every router, in order of router id
+    """
+    if params is None:
+        params = get_dragonfly_params()
+    names = []
+    for group in range(params['groups_per_system']):
+        for chassis in range(params['chassis_per_group']):
+            for slot in range(params['slots_per_chassis']):
+                names.append(slotname(group, chassis, slot))
+    return names
+
+def build_adjacency( links, params=None ):
+    """
+    Converts ( end1, end2, rank, links ) tuples from iter_dragonfly into a
+    symmetric compressed sparse row (CSR) adjacency structure over integer
+    router ids.  Duplicate links between the same pair of routers are
+    collapsed into one entry whose multiplicity is the number of links.
+    Returns ( indptr, indices, multiplicity ), where the neighbors of router
+    i are indices[indptr[i]:indptr[i+1]]
+    """
+    names = router_names( params )
+    end1, end2, rank, count = link_arrays( links,
+        dict(zip(names, range(len(names)))) )
+    return adjacency_from_arrays( end1, end2, count, len(names) )
+
+def adjacency_from_arrays( end1, end2, count, n_routers ):
+    """
+    build_adjacency for links already held in router id arrays
+    """
+    pair_keys = np.minimum(end1, end2) * n_routers + np.maximum(end1, end2)
+    keys, inverse = np.unique(pair_keys, return_inverse=True)
+    multiplicity = np.bincount(inverse, weights=count).astype(np.int64)
+    rows = np.concatenate((keys // n_routers, keys % n_routers))
+    cols = np.concatenate((keys % n_routers, keys // n_routers))
+    multiplicity = np.concatenate((multiplicity, multiplicity))
+
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_routers + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=n_routers))
+    return indptr, cols[order], multiplicity[order]
+
+def minimal_routes( indptr, indices, block_size=None, count_paths=True,
+                    sources=None ):
+    """
+    Breadth-first search from every router at once.  Returns ( hops, paths ),
+    two routers x routers arrays holding the minimal hop count between each
+    pair of routers (-1 if unreachable) and the number of distinct minimal
+    router-to-router paths between them (None unless count_paths).  Given an
+    array of source routers, only their rows are found.  Sources are
+    processed in blocks; each BFS level expands every (source, frontier
+    router) entry of the block into its CSR neighbor list with np.repeat and
+    sums the path counts arriving at each (source, router) with one bincount
+    """
+    n_routers = len(indptr) - 1
+    degree = np.diff(indptr)
+    if sources is None:
+        sources = np.arange(n_routers)
+    if block_size is None:
+        block_size = max(1, min(n_routers, (1 << 24) // max(1, len(indices))))
+
+    hops = np.full((len(sources), n_routers), -1, dtype=np.int16)
+    paths = None
+    if count_paths:
+        paths = np.zeros((len(sources), n_routers), dtype=np.int64)
+    for first in range(0, len(sources), block_size):
+        block = slice(first, min(first + block_size, len(sources)))
+        n_block = block.stop - block.start
+        block_hops = hops[block].ravel()
+        if count_paths:
+            block_paths = paths[block].ravel()
+        else:
+            block_paths = np.zeros(n_block * n_routers, dtype=np.int64)
+
+        # the frontier is a list of ( row in block, router, path count )
+        row = np.arange(n_block)
+        router = sources[block]
+        count = np.ones(n_block, dtype=np.int64)
+        block_hops[row * n_routers + router] = 0
+        block_paths[row * n_routers + router] = 1
+        level = 0
+        while len(router):
+            level += 1
+            fanout = degree[router]
+            entry = np.repeat(np.arange(len(router)), fanout)
+            offset = np.arange(len(entry)) + \
+                (indptr[router] - (np.cumsum(fanout) - fanout))[entry]
+            target = row[entry] * n_routers + indices[offset]
+            arriving = np.bincount(target, weights=count[entry],
+                minlength=len(block_hops))
+            new = np.nonzero((arriving > 0) & (block_hops < 0))[0]
+            block_hops[new] = level
+            block_paths[new] = arriving[new]
+            row, router = new // n_routers, new % n_routers
+            count = block_paths[new]
+
+        hops[block] = block_hops.reshape(n_block, n_routers)
+        if count_paths:
+            paths[block] = block_paths.reshape(n_block, n_routers)
+    return hops, paths
+
+def valiant_histogram( hops ):
+    """
+    Histogram of Valiant path lengths, hops(s,i) + hops(i,t), over every
+    ordered pair of distinct routers s, t and every intermediate router i
+    other than s and t.  With H[i,k] the number of routers k hops from i, the
+    count of length L is the sum over a + b = L of (H^T H)[a,b], less the
+    s == t terms and the i == s and i == t terms, which are just the minimal
+    routes.  Assumes a connected, symmetric network
+    """
+    max_hops = int(hops.max())
+    per_router = np.zeros((hops.shape[0], max_hops + 1), dtype=np.int64)
+    for k in range(max_hops + 1):
+        per_router[:, k] = (hops == k).sum(axis=1)
+    pairs = np.dot(per_router.T, per_router)
+
+    histogram = np.zeros(2 * max_hops + 1, dtype=np.int64)
+    for a in range(max_hops + 1):
+        histogram[a:a + max_hops + 1] += pairs[a]
+    at_distance = per_router.sum(axis=0)    # ordered router pairs k hops apart
+    histogram[::2] -= at_distance
+    histogram[1:max_hops + 1] -= 2 * at_distance[1:]
+    return histogram
+
+def print_route_analysis( links, params=None ):
+    if params is None:
+        params = get_dragonfly_params()
+    indptr, indices, multiplicity = build_adjacency( links, params )
+    n_routers = len(indptr) - 1
+    hops, paths = minimal_routes( indptr, indices )
+    upper = np.triu_indices(n_routers, 1)
+    pair_hops = hops[upper]
+    pair_paths = paths[upper]
+
+    print( "Routers:          %d in %d groups"
+        % ( n_routers, params['groups_per_system'] ) )
+    print( "Links:            %d between %d router pairs"
+        % ( multiplicity.sum() // 2, len(indices) // 2 ) )
+    if (pair_hops < 0).any():
+        print( "Unreachable:      %d router pairs" % (pair_hops < 0).sum() )
+        pair_paths = pair_paths[pair_hops >= 0]
+        pair_hops = pair_hops[pair_hops >= 0]
+    if not len(pair_hops):
+        return
+
+    print( "\nMinimal routes (diameter %d, mean %.3f hops):"
+        % ( pair_hops.max(), pair_hops.mean() ) )
+    print( "  hops       pairs   min paths  mean paths   max paths" )
+    for h in range(1, pair_hops.max() + 1):
+        at_h = pair_hops == h
+        if not at_h.any():
+            continue
+        print( "  %4d %11d %11d %11.2f %11d" % ( h, at_h.sum(),
+            pair_paths[at_h].min(), pair_paths[at_h].mean(),
+            pair_paths[at_h].max() ) )
+
+    if (hops < 0).any():
+        return
+    histogram = valiant_histogram( hops )
+    lengths = np.arange(len(histogram))
+    print( "\nValiant routes via every other router (mean %.3f hops):"
+        % ( float((histogram * lengths).sum()) / histogram.sum() ) )
+    print( "  hops       paths" )
+    for h in range(1, len(histogram)):
+        if histogram[h]:
+            print( "  %4d %11d" % ( h, histogram[h] ) )
+
+def link_arrays( links, index=None, params=None ):
+    """
+    Collects ( end1, end2, rank, links ) tuples into four integer arrays,
+    accumulating them in compact typed arrays rather than a list of tuples.
+    Router names are converted to ids with index (router name -> id)
+    """
+    if index is None:
+        names = router_names( params )
+        index = dict(zip(names, range(len(names))))
+    columns = [ array('l'), array('l'), array('l'), array('l') ]
+    for end1, end2, rank, count in links:
+        columns[0].append(index[end1])
+        columns[1].append(index[end2])
+        columns[2].append(rank)
+        columns[3].append(count)
+    return [ np.array(column, dtype=np.int64) for column in columns ]
+
+class DragonflyTopology( topology.Topology ):
+    """
+    A dragonfly system behind the topology.Topology interface shared with
+    gordon-topology.py, so that hop histograms, node lists and graphs are
+    made the same way for both.  The routers are the endpoints, and
+    nodes_per_router compute nodes hang off each one, named nidNNNNN in
+    router order as on a Cray.  Rows of the router hop table are found with
+    minimal_routes the first time they are asked for and kept, so queries on
+    a few routers of a large system never search from all of them
+    """
+
+    __slots__ = ( 'params', 'node_names', 'node_index', 'endpoint_names',
+                  'node_endpoint', 'end1', 'end2', 'count', 'adjacency',
+                  'hop_rows' )
+
+    def __init__( self, params=None, nodes_per_router=_NODES_PER_ROUTER ):
+        if params is None:
+            params = get_dragonfly_params()
+        self.params = params
+        self.endpoint_names = router_names( params )
+        self.end1, self.end2, rank, self.count = link_arrays(
+            iter_dragonfly( params ),
+            dict(zip(self.endpoint_names, range(len(self.endpoint_names)))) )
+        n_nodes = len(self.endpoint_names) * nodes_per_router
+        self.node_names = [ 'nid%05d' % nid for nid in range(n_nodes) ]
+        self.node_index = dict(zip(self.node_names, range(n_nodes)))
+        self.node_endpoint = np.arange(n_nodes) // nodes_per_router
+        self.adjacency = adjacency_from_arrays( self.end1, self.end2,
+            self.count, len(self.endpoint_names) )
+        self.hop_rows = {}
+
+    def endpoint_links( self ):
+        return self.end1, self.end2
+
+    def endpoint_hops( self ):
+        return self.endpoint_rows( np.arange(len(self.endpoint_names)) )
+
+    def endpoint_rows( self, endpoints ):
+        endpoints = np.asarray(endpoints, dtype=int)
+        missing = np.array(sorted(set(endpoints.tolist())
+                                  - set(self.hop_rows)), dtype=int)
+        if len(missing):
+            indptr, indices, multiplicity = self.adjacency
+            hops = minimal_routes( indptr, indices, count_paths=False,
+                sources=missing )[0]
+            self.hop_rows.update(zip(missing.tolist(), hops))
+        if not len(endpoints):
+            return np.zeros((0, len(self.endpoint_names)), dtype=np.int16)
+        return np.array([ self.hop_rows[endpoint]
+                          for endpoint in endpoints.tolist() ])
+
+def print_router_population(group_connectivity, router_ports):
+    for group_pairs, links in group_connectivity.items():
         end1, end2 = group_pairs.split('=')
         group1 = int(end1.split('-',1)[0])
         group2 = int(end2.split('-',1)[0])
-        print "%20s %d from %d and %d" % ( 
+        print( "%20s %d from %d and %d" % ( 
             group_pairs, 
             links,
             router_ports[group1][end1],
             router_ports[group2][end2]
-        )
-        
-def print_dotfile( connections ):
-    print """graph dragonfly {
+        ) )
+
+def print_dotfile( links, out=sys.stdout ):
+    """
+    Writes links in the dot format in a single pass, with each rank in its
+    own subgraph and parallel links merged into one weighted edge
+    """
+    out.write("""graph dragonfly {
     overlap=false;
     splines=true;
     node [label="",width=0.05,height=0.05,style=filled,color=red];
-    subgraph rank1 {
-        edge [color=green];"""
-    for connection in connections:
-        if connection[2] == 1:
-            print '        "%s" -- "%s";' % ( connection[0], connection[1] )
-    print """    }
-    subgraph rank2 {
-        edge [color=black];"""
-    for connection in connections:
-        if connection[2] == 2:
-            print '        "%s" -- "%s";' % ( connection[0], connection[1] )
-    print """    }
-    subgraph rank3 {
-        edge [color=blue];"""
-    for connection in connections:
-        if connection[2] == 3:
-            print '        "%s" -- "%s";' % ( connection[0], connection[1] )
-    print "    }"
-    print "}"
+""")
+    colors = { 1: 'green', 2: 'black', 3: 'blue' }
+    this_rank = None
+    for end1, end2, rank, count in links:
+        if rank != this_rank:
+            if this_rank is not None:
+                out.write("    }\n")
+            out.write("    subgraph rank%d {\n        edge [color=%s];\n"
+                % ( rank, colors.get(rank, 'black') ))
+            this_rank = rank
+        if count > 1:
+            out.write('        "%s" -- "%s" [weight=%d];\n' % ( end1, end2, count ))
+        else:
+            out.write('        "%s" -- "%s";\n' % ( end1, end2 ))
+    if this_rank is not None:
+        out.write("    }\n")
+    out.write("}\n")
+
+def print_edgelist( links, out=sys.stdout ):
+    """
+    Writes one "end1 end2 rank links" line per connected pair of routers
+    """
+    for end1, end2, rank, count in links:
+        out.write("%s %s %d %d\n" % ( end1, end2, rank, count ))
+
+def print_graphml( links, out=sys.stdout, params=None ):
+    """
+    Writes links as GraphML with rank and link-count edge attributes.  Router
+    nodes are declared up front so the edges can be streamed as generated
+    """
+    out.write("""<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key id="rank" for="edge" attr.name="rank" attr.type="int"/>
+  <key id="weight" for="edge" attr.name="weight" attr.type="int"/>
+  <graph id="dragonfly" edgedefault="undirected">
+""")
+    for name in router_names( params ):
+        out.write('    <node id="%s"/>\n' % name)
+    for end1, end2, rank, count in links:
+        out.write('    <edge source="%s" target="%s"><data key="rank">%d</data>'
+            '<data key="weight">%d</data></edge>\n' % ( end1, end2, rank, count ))
+    out.write("  </graph>\n</graphml>\n")
+
+def save_npz( links, npz_file, params=None ):
+    """
+    Saves links as NumPy arrays: per-pair edge arrays (end1, end2, rank,
+    links), the CSR adjacency from build_adjacency (indptr, indices,
+    multiplicity) and the router names, indexed by router id
+    """
+    names = router_names( params )
+    end1, end2, rank, count = link_arrays( links,
+        dict(zip(names, range(len(names)))) )
+    indptr, indices, multiplicity = adjacency_from_arrays( end1, end2, count,
+        len(names) )
+    np.savez_compressed( npz_file, end1=end1, end2=end2, rank=rank,
+        links=count, indptr=indptr, indices=indices, multiplicity=multiplicity,
+        names=np.array(names) )
+
+def global_link_matrix( end1, end2, rank, count, params ):
+    """
+    Returns a symmetric matrix of the number of rank-3 (global) links between
+    every pair of groups, from the arrays returned by link_arrays
+    """
+    n_groups = params['groups_per_system']
+    routers_per_group = params['chassis_per_group'] * params['slots_per_chassis']
+    global_links = np.zeros((n_groups, n_groups), dtype=np.int64)
+    is_global = rank == 3
+    np.add.at(global_links, ( end1[is_global] // routers_per_group,
+                              end2[is_global] // routers_per_group ),
+              count[is_global])
+    return global_links + global_links.T
+
+def read_allocations( alloc_file, params=None ):
+    """
+    Reads one job per line as "jobid router [router ...]", where each router
+    is a name from router_names or an integer router id and is listed once
+    for every node the job has on it, in rank order.  Returns the job ids and
+    two arrays giving the job number and router id of every node, grouped by
+    job
+    """
+    names = router_names( params )
+    index = dict(zip(names, range(len(names))))
+    jobids = []
+    node_job = array('l')
+    node_router = array('l')
+    with open(alloc_file, 'r') as fp:
+        for line in fp:
+            fields = line.replace(',', ' ').split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            routers = []
+            for field in fields[1:]:
+                if field in index:
+                    routers.append(index[field])
+                elif field.isdigit() and int(field) < len(names):
+                    routers.append(int(field))
+                else:
+                    raise ValueError('job %s: unknown router %s'
+                        % ( fields[0], field ))
+            if not routers:
+                continue
+            node_job.extend([ len(jobids) ] * len(routers))
+            node_router.extend(routers)
+            jobids.append(fields[0])
+    return jobids, np.array(node_job, dtype=np.int64), \
+        np.array(node_router, dtype=np.int64)
+
+def group_traffic( node_job, node_group, n_jobs, n_groups, pattern='alltoall' ):
+    """
+    Counts the rank pairs of every job that communicate from one group to
+    another.  pattern is 'alltoall' or 'neighbor' (each rank talks to both of
+    its neighbors on a ring in rank order).  Returns an array of shape
+    ( n_jobs, n_groups, n_groups ) of directed group-to-group flows, with
+    traffic within a group left out
+    """
+    if pattern == 'neighbor':
+        # next rank on the ring; the last rank of each job wraps to its first
+        first = np.flatnonzero(np.r_[True, node_job[1:] != node_job[:-1]])
+        last = np.r_[first[1:], len(node_job)] - 1
+        ring_next = np.arange(1, len(node_job) + 1)
+        ring_next[last] = first
+        keys = ( node_job * n_groups + node_group ) * n_groups \
+             + node_group[ring_next]
+        flows = np.bincount(keys, minlength=n_jobs * n_groups * n_groups)
+        flows = flows.reshape(n_jobs, n_groups, n_groups)
+        flows = flows + flows.transpose(0, 2, 1)
+    else:
+        ranks = np.bincount(node_job * n_groups + node_group,
+            minlength=n_jobs * n_groups).reshape(n_jobs, n_groups)
+        flows = ranks[:, :, np.newaxis] * ranks[:, np.newaxis, :]
+    flows[:, np.arange(n_groups), np.arange(n_groups)] = 0
+    return flows
+
+def compact_groups( node_job, params, nodes_per_router=_NODES_PER_ROUTER ):
+    """
+    Returns the group of every node if each job were instead packed onto
+    consecutive routers starting from router 0, in the same rank order
+    """
+    per_group = params['chassis_per_group'] * params['slots_per_chassis'] \
+              * nodes_per_router
+    starts = np.r_[0, np.flatnonzero(node_job[1:] != node_job[:-1]) + 1]
+    first = np.repeat(starts, np.diff(np.r_[starts, len(node_job)]))
+    position = np.arange(len(node_job)) - first
+    return np.minimum(position // per_group, params['groups_per_system'] - 1)
+
+def score_placement( node_job, node_group, n_jobs, global_links, pattern ):
+    """
+    Counts every job's flows between each pair of groups, each of which
+    crosses one of the global links joining the two groups on a minimal
+    route.  Which of those links a flow takes is not modelled: a group
+    pair's flows are averaged over its links, so the highest load is that of
+    the most loaded group pair and a single link may carry more.  Returns
+    arrays of the groups spanned, the flows crossing global links, the
+    highest group-pair average and the mean over the links of the group
+    pairs used (in flows per link), and the group pair with the highest
+    average
+    """
+    n_groups = len(global_links)
+    spanned = np.bincount(node_job * n_groups + node_group,
+        minlength=n_jobs * n_groups).reshape(n_jobs, n_groups)
+    spanned = (spanned > 0).sum(axis=1)
+
+    flows = group_traffic( node_job, node_group, n_jobs, n_groups, pattern )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        load = np.where(flows > 0, flows / global_links.astype(float), 0.0)
+    hottest = load.reshape(n_jobs, -1).argmax(axis=1)
+    max_load = load.reshape(n_jobs, -1).max(axis=1)
+
+    # each unordered pair of groups is joined by its global links in both
+    # directions
+    links_used = np.where(flows > 0, global_links, 0).sum(axis=(1, 2))
+    crossing = flows.sum(axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_load = np.where(links_used > 0, crossing / links_used.astype(float),
+                             0.0)
+    return spanned, crossing, max_load, mean_load, \
+        np.array(divmod(hottest, n_groups)).T
+
+def print_placement( allocations, params, pattern='alltoall' ):
+    """
+    Prints a CSV line for every job in allocations (as returned by
+    read_allocations) comparing its global link use against a compact
+    placement of the same number of nodes
+    """
+    jobids, node_job, node_router = allocations
+    names = router_names( params )
+    end1, end2, rank, count = link_arrays( iter_dragonfly( params ),
+        dict(zip(names, range(len(names)))) )
+    global_links = global_link_matrix( end1, end2, rank, count, params )
+
+    routers_per_group = params['chassis_per_group'] * params['slots_per_chassis']
+    n_jobs = len(jobids)
+    nodes = np.bincount(node_job, minlength=n_jobs)
+    actual = score_placement( node_job, node_router // routers_per_group,
+        n_jobs, global_links, pattern )
+    compact = score_placement( node_job, compact_groups( node_job, params ),
+        n_jobs, global_links, pattern )
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow([ 'jobid', 'nodes', 'groups', 'global_flows',
+        'max_pair_link_load', 'mean_pair_link_load', 'hottest_groups',
+        'compact_groups', 'compact_global_flows',
+        'compact_max_pair_link_load' ])
+    for i in range(n_jobs):
+        hottest = '%d-%d' % tuple(actual[4][i]) if actual[1][i] else ''
+        writer.writerow([ jobids[i], nodes[i], actual[0][i], actual[1][i],
+            '%.4f' % actual[2][i], '%.4f' % actual[3][i], hottest,
+            compact[0][i], compact[1][i], '%.4f' % compact[2][i] ])
+
+def summarize_dragonfly( params ):
+    """
+    Builds the system described by params and returns a dictionary of its
+    rank-3 (global) link counts per group pair, the balance of port use
+    across routers, and its minimal-hop diameter
+    """
+    names = router_names( params )
+    n_routers = len(names)
+    n_groups = params['groups_per_system']
+    end1, end2, rank, count = link_arrays( iter_dragonfly( params ),
+        dict(zip(names, range(n_routers))) )
+
+    ports = np.bincount(end1, weights=count, minlength=n_routers) \
+          + np.bincount(end2, weights=count, minlength=n_routers)
+
+    global_links = global_link_matrix( end1, end2, rank, count, params )
+    pair_links = global_links[np.triu_indices(n_groups, 1)]
+
+    indptr, indices, multiplicity = adjacency_from_arrays( end1, end2, count,
+        n_routers )
+    hops, paths = minimal_routes( indptr, indices )
+    connected = bool((hops >= 0).all())
+
+    summary = {
+        'params':       params,
+        'routers':      n_routers,
+        'links':        dict([ ( 'rank%d' % r, int(count[rank == r].sum()) )
+                               for r in ( 1, 2, 3 ) ]),
+        'global_links_per_group_pair': {
+            'min':      int(pair_links.min()) if len(pair_links) else 0,
+            'max':      int(pair_links.max()) if len(pair_links) else 0,
+            'mean':     float(pair_links.mean()) if len(pair_links) else 0.0,
+            'matrix':   global_links.tolist() },
+        'ports_used': {
+            'min':      int(ports.min()),
+            'max':      int(ports.max()),
+            'mean':     float(ports.mean()),
+            'std':      float(ports.std()),
+            'free':     int(params['tiles_per_router'] * n_routers - ports.sum()) },
+        'connected':    connected,
+        'diameter':     int(hops.max()) if connected else -1,
+        'mean_hops':    float(hops[np.triu_indices(n_routers, 1)].mean())
+                        if connected and n_routers > 1 else 0.0,
+    }
+    return summary
+
+_SWEEP_VERSION = 1  # part of every --sweep cache key; bump it whenever
+                    # summarize_dragonfly's results change
+
+def sweep_dragonfly( configs, jobs=None, cache_dir=None ):
+    """
+    Summarizes every configuration in configs (a list of params dictionaries)
+    using a pool of jobs worker processes, and yields the summaries in order.
+    Each summary is saved as JSON in cache_dir and reused on later sweeps
+    """
+    def cache_file( params ):
+        key = hashlib.md5(json.dumps([ _SWEEP_VERSION, params ],
+                                     sort_keys=True).encode()).hexdigest()
+        return os.path.join(cache_dir, 'dragonfly-%s.json' % key)
+
+    results = [ None ] * len(configs)
+    if cache_dir:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        for i, params in enumerate(configs):
+            try:
+                with open(cache_file(params), 'r') as fp:
+                    results[i] = json.load(fp)
+            except (IOError, OSError, ValueError):
+                pass
+
+    todo = [ params for params, result in zip(configs, results) if result is None ]
+    if len(todo) > 1 and jobs != 1:
+        pool = phase_profile.Pool(jobs)
+        summaries = pool.imap( summarize_dragonfly, todo )
+    else:
+        pool = None
+        summaries = ( summarize_dragonfly(params) for params in todo )
+
+    try:
+        for params, result in zip(configs, results):
+            if result is None:
+                result = next(summaries)
+                if cache_dir:
+                    with open(cache_file(params), 'w') as fp:
+                        json.dump(result, fp, sort_keys=True)
+            yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+_PARAM_OPTIONS = [ # ( option, params key )
+    ( 'groups',     'groups_per_system' ),
+    ( 'chassis',    'chassis_per_group' ),
+    ( 'slots',      'slots_per_chassis' ),
+    ( 'tiles',      'tiles_per_router' ),
+    ( 'rank1-lpc',  'rank1_lpc' ),
+    ( 'rank2-lpc',  'rank2_lpc' ),
+    ( 'rank3-lpc',  'rank3_lpc' ),
+]
+
+_PROFILED = [ # functions timed as phases by --profile
+    'build_dragonfly', 'build_adjacency', 'minimal_routes',
+    'valiant_histogram', 'print_route_analysis', 'link_arrays',
+    'print_dotfile', 'print_edgelist', 'print_graphml', 'save_npz',
+    'read_allocations', 'group_traffic', 'compact_groups', 'score_placement',
+    'print_placement', 'summarize_dragonfly' ]
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0],
+        description='Generate the connectivity of a dragonfly network')
+    parser.add_argument('--analyze', action='store_true',
+        help='print minimal and Valiant route statistics instead of a graph')
+    parser.add_argument('--placement', metavar='FILE',
+        help='score the global link use of the job allocations in FILE, one '
+             '"jobid router [router ...]" line per job; link loads are flows '
+             'per global link averaged over each group pair\'s links')
+    parser.add_argument('--pattern', default='alltoall',
+        choices=[ 'alltoall', 'neighbor' ],
+        help='traffic pattern for --placement (default: alltoall)')
+    parser.add_argument('--hops', metavar='NODE', nargs='+',
+        help='print the distribution of hop distances between every pair of '
+             'the given compute nodes (nidNNNNN), as gordon-topology.py does')
+    parser.add_argument('--nodes', nargs='?', const='list',
+        choices=[ 'list', 'dot' ],
+        help='print the compute nodes attached to each router, as a list or '
+             'with --nodes dot as dot edges like gordon-topology.py --graph')
+    parser.add_argument('--format', default='dot',
+        choices=[ 'dot', 'graphml', 'edgelist', 'npz' ],
+        help='graph output format (default: dot)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help='write the graph to FILE instead of stdout (required for npz)')
+    defaults = get_dragonfly_params()
+    for option, key in _PARAM_OPTIONS:
+        parser.add_argument('--' + option, metavar='N[,N...]',
+            default=str(defaults[key]),
+            help='%s (default: %d); a comma-separated list with --sweep'
+                % ( key.replace('_', ' '), defaults[key] ))
+    parser.add_argument('--sweep', action='store_true',
+        help='print a JSON summary of every combination of the listed '
+             'parameters instead of a graph')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='worker processes for --sweep (default: one per core)')
+    parser.add_argument('--cache-dir', metavar='DIR',
+        default=os.path.join(os.path.expanduser('~'), '.cache',
+                             'dragonfly-topology'),
+        help='where --sweep keeps per-configuration results (default: %(default)s)')
+    phase_profile.add_arguments(parser)
+    try:
+        profiler, argv = phase_profile.from_argv(argv)
+    except ValueError as e:
+        parser.error(str(e))
+    options = parser.parse_args(argv[1:])
+    profiler.instrument(globals(), _PROFILED)
+
+    grid = []
+    for option, key in _PARAM_OPTIONS:
+        try:
+            values = [ int(x) for x in
+                       getattr(options, option.replace('-', '_')).split(',') ]
+        except ValueError:
+            parser.error('--%s needs integers' % option)
+        grid.append( [ ( key, value ) for value in values ] )
+    try:
+        configs = [ get_dragonfly_params( **dict(combination) )
+                    for combination in itertools.product(*grid) ]
+    except ValueError as e:
+        parser.error(str(e))
+
+    if options.sweep:
+        for summary in sweep_dragonfly( configs, options.jobs, options.cache_dir ):
+            sys.stdout.write(json.dumps(summary, sort_keys=True) + '\n')
+            sys.stdout.flush()
+        return
+    if len(configs) > 1:
+        parser.error('lists of parameter values need --sweep')
+    params = configs[0]
+
+    if options.placement:
+        try:
+            allocations = read_allocations( options.placement, params )
+        except (IOError, ValueError) as e:
+            sys.stderr.write('%s\n' % e)
+            sys.exit(1)
+        print_placement( allocations, params, options.pattern )
+        return
+    if options.analyze:
+        print_route_analysis( iter_dragonfly( params ), params )
+        return
+    if options.hops:
+        try:
+            histogram = DragonflyTopology( params ).histogram( options.hops )
+        except KeyError as e:
+            sys.stderr.write('Invalid node: %s\n' % e.args[0])
+            sys.exit(1)
+        except ValueError as e:
+            sys.stderr.write('%s\n' % e)
+            sys.exit(1)
+        topology.print_hop_histogram( histogram, len(options.hops) )
+        return
+    if options.nodes == 'dot':
+        topology.print_dot( DragonflyTopology( params ) )
+        return
+    if options.nodes:
+        topology.print_node_list( DragonflyTopology( params ) )
+        return
+    if options.format == 'npz':
+        if not options.output:
+            parser.error('--format npz needs --output')
+        save_npz( iter_dragonfly( params ), options.output, params )
+        return
+
+    if options.format == 'graphml':
+        writer = lambda links, out: print_graphml( links, out, params )
+    else:
+        writer = { 'dot': print_dotfile,
+                   'edgelist': print_edgelist }[options.format]
+    if options.output:
+        with open(options.output, 'w') as out:
+            writer( iter_dragonfly( params ), out )
+    else:
+        writer( iter_dragonfly( params ), sys.stdout )
 
 if __name__ == '__main__':
-    print_dotfile( build_dragonfly() )
+    main(sys.argv)
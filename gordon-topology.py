@@ -5,19 +5,109 @@
 #
 #  Glenn K. Lockwood, San Diego Supercomputer Center                June 2013
 
+from __future__ import print_function
 import sys
+import os
+import struct
+import mmap
+import hashlib
+import csv
+import re
+import argparse
+import warnings
+import heapq
+import json
+import xml.etree.ElementTree as ElementTree
+import phase_profile
+import topology
+import torque_xml
+# NumPy is imported by the functions that use it, so that the hop queries on a
+# few nodes answer without waiting for it to load
+
+### phases timed by --profile
+_PROFILED = [ 'get_gordon_topology', 'load_gordon_topology', 'load_topology',
+    'read_faults', 'calculate_hop_pair', 'calculate_hop_distribution',
+    'calculate_batch_hops', 'select_nodes',
+    'get_ring_pairs', 'get_ion_traffic', 'get_alltoall_traffic',
+    'read_traffic_matrix', 'get_link_loads',
+    'print_congestion', 'get_ion_hop_table', 'get_comm_cost',
+    'print_comm_cost', 'get_grid_pairs', 'reorder_ranks',
+    'get_job_link_loads', 'print_interference', 'print_torus_graph' ]
 
 def main(argv):
 
+    try:
+        profiler, argv = phase_profile.from_argv(argv)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+    profiler.instrument(globals(), _PROFILED)
+
+    faults_file = None
+    if '--faults' in argv[:-1]:
+        index = argv.index('--faults')
+        faults_file = argv[index+1]
+        argv = argv[:index] + argv[index+2:]
+
     if len(argv) > 1 and (argv[1] == '--help' or argv[1] == '-h'):
         print_help(argv)
         sys.exit(0)
+    if len(argv) > 1 and argv[1] == '--batch':
+        output_format = 'csv'
+        inputs = argv[2:]
+        if inputs and inputs[0] == '--json':
+            output_format = 'json'
+            inputs = inputs[1:]
+        topo = load_topology(faults_file)
+        try:
+            if not inputs:
+                calculate_batch_hops(sys.stdin, topo, output_format)
+            for input_file in inputs:
+                with open(input_file, 'r') as fp:
+                    calculate_batch_hops(fp, topo, output_format)
+        except (IOError, OSError, ElementTree.ParseError) as e:
+            sys.stderr.write('%s\n' % e)
+            sys.exit(1)
+        sys.exit(0)
+    if len(argv) > 1 and argv[1] == '--graph':
+        if len(argv) > 2:
+            print_torus_graph([ int(x) for x in argv[2].split('x') ])
+        else:
+            topology.print_dot(load_topology())
+        sys.exit(0)
+    if len(argv) > 1 and argv[1] == '--congestion':
+        congestion_main(argv[0], argv[2:], faults_file)
+        sys.exit(0)
+    if len(argv) > 1 and argv[1] == '--comm-cost':
+        comm_cost_main(argv[0], argv[2:], faults_file)
+        sys.exit(0)
+    if len(argv) > 1 and argv[1] == '--interference':
+        interference_main(argv[0], argv[2:], faults_file)
+        sys.exit(0)
+    if len(argv) > 1 and argv[1] == '--reorder':
+        reorder_main(argv[0], argv[2:], faults_file)
+        sys.exit(0)
+    if len(argv) > 2 and argv[1] == '--select':
+        select_nodes_main(argv[2:], faults_file)
+        sys.exit(0)
     if len(argv) == 2:
         sys.stderr.write('You must provide at least two nodes to calculate '
             + 'hop distances.\n')
         sys.exit(1)
 
-    # define key parameters describing Gordon's layout
+    topo_params = get_topo_params()
+    topo = load_topology(faults_file)
+    if len(argv) > 3:
+        calculate_hop_distribution(argv[1:], topo)
+    elif len(argv) == 3:
+        calculate_hop_pair( argv[1:], topo )
+    else:
+        # IONs are listed a compute rack at a time, their nodes a row per line
+        topology.print_node_list(topo, topo_params['compute_per_row'],
+                                 topo_params['subracks_per_rack'])
+
+### get_topo_params: define key parameters describing Gordon's layout
+def get_topo_params():
     topo_params = {
         'torus_size':           ( 4, 4, 4 ),
         'ion_racks':            [ 1, 10, 12, 21 ],
@@ -39,139 +129,914 @@ def main(argv):
     topo_params['total_computes'] = ( topo_params['total_ions']
                                     * topo_params['compute_per_ion'] )
     topo_params['total_subracks'] = ( topo_params['total_computes']
-                                    / topo_params['compute_per_subrack'] )
+                                    // topo_params['compute_per_subrack'] )
     topo_params['subracks_per_rack']  = ( topo_params['total_subracks']
-                                        / len(topo_params['compute_racks']) )
+                                        // len(topo_params['compute_racks']) )
 
-    topo_data = get_gordon_topology(topo_params)
-    if len(argv) > 3:
-        calculate_hop_distribution(argv[1:], topo_data)
-    elif len(argv) == 3:
-        calculate_hop_pair( argv[1:], topo_data )
+    return topo_params
+
+### print_torus_graph: print the links of a bare torus of any size and
+###   dimensionality in the 'dot' format, naming each switch by its coordinates
+def print_torus_graph(torus_size):
+    import numpy as np
+    coords = torus_coords(np.arange(np.prod(torus_size)), torus_size)
+    names = np.array([ '-'.join([ str(x) for x in coord ]) for coord in coords ])
+    end1, end2 = torus_links(torus_size)
+    sys.stdout.write('graph torus {\n')
+    for chunk in range(0, len(end1), 65536):
+        sys.stdout.write(''.join([ '    "%s" -- "%s";\n' % pair for pair in
+            zip(names[end1[chunk:chunk+65536]], names[end2[chunk:chunk+65536]]) ]))
+    sys.stdout.write('}\n')
+
+def calculate_hop_pair( node_list, topo ):
+    try:
+        ion1, ion2 = topo.ions(node_list[0]), topo.ions(node_list[1])
+    except KeyError as e:
+        sys.stderr.write('Invalid node: %s\n' % e.args[0])
+        sys.exit(1)
+    hops = topo.endpoint_hop( ion1, ion2 )
+    print( "%10s at ( %d, %d, %d )" % (node_list[0], 
+        topo.ion_coords[ion1][0],
+        topo.ion_coords[ion1][1],
+        topo.ion_coords[ion1][2]) )
+    print( "%10s at ( %d, %d, %d )" % (node_list[1], 
+        topo.ion_coords[ion2][0],
+        topo.ion_coords[ion2][1],
+        topo.ion_coords[ion2][2]) )
+    if hops < 0:
+        print( "unreachable" )
     else:
-        print_gordon_nodes(topo_data, topo_params)
-
-### print_gordon_nodes: generate pretty printout of all Gordon compute nodes
-###   grouped by their associated IO node
-def print_gordon_nodes(topo_data, topo_params):
-    for abs_ion, ion in enumerate(topo_data['ion_list']):
-        # extra blank line separating compute racks
-        if (abs_ion % topo_params['subracks_per_rack']) == 0:
-            sys.stdout.write("\n")
-        # print io node name
-        sys.stdout.write( '== %s at (%d, %d, %d) ==' % (ion, 
-            topo_data['ion2torus'][ion][0],
-            topo_data['ion2torus'][ion][1],
-            topo_data['ion2torus'][ion][2]) )
-        # print all compute nodes arranged according to subrack
-        for index, node in enumerate(topo_data['ion2compute'][ion]):
-            if (index % topo_params['compute_per_ion']) == 0:
-                sys.stdout.write("\n");
-            sys.stdout.write("%10s" % node)
-            if ((index+1) % topo_params['compute_per_row']) == 0:
-                sys.stdout.write("\n");
-
-### print_gordon_graph: generate graph connectivity data in the 'dot' format
-###   amenable to being plugged into graphviz
-def print_gordon_graph(topo_data, topo_params):
-    n_ions = len(topo_data['ion_list'])
-    neighbor_count = {}
-
-    # Print torus nodes
-    for i in range(0, n_ions-1):
-        for j in range(i+1, n_ions):
-            ion1, ion2 = ( topo_data['ion_list'][i], topo_data['ion_list'][j] )
-            hops = get_hops( topo_data['ion2torus'][ion1], 
-                             topo_data['ion2torus'][ion2],
-                             topo_data['torus_size'] )
-            if hops == 1:
-                print( '"%s" -- "%s";' % (ion1, ion2) )
-                try:
-                    neighbor_count[ion1]
-                except KeyError:
-                    neighbor_count[ion1] = 1
-                else:
-                    neighbor_count[ion1] += 1
-                try:
-                    neighbor_count[ion2]
-                except KeyError:
-                    neighbor_count[ion2] = 1
-                else:
-                    neighbor_count[ion2] += 1
-
-    for ion in topo_data['ion_list']:
-        for compute in topo_data['ion2compute'][ion]:
-            print( '"%s" -- "%s";' % ( ion, compute ) )
-
-    # print number of neighbors to check validity
-#   for index,ion in enumerate(topo_data['ion_list']):
-#       try: neighbor_count[ion]
-#       except KeyError:
-#           print( "%s (%d) had no neighbors???" % (ion, index) )
-#       else:
-#           print( "%s (%d) had %d neighbors" % ( ion, index, neighbor_count[ion] ) )
-
-def calculate_hop_pair( node_list, topo_data ):
-    ion1 = topo_data['compute2ion'][node_list[0]]
-    ion2 = topo_data['compute2ion'][node_list[1]]
-    hops = get_hops( topo_data['ion2torus'][ion1], topo_data['ion2torus'][ion2],
-            topo_data['torus_size'] )
-    print "%10s at ( %d, %d, %d )" % (node_list[0], 
-        topo_data['ion2torus'][ion1][0],
-        topo_data['ion2torus'][ion1][1],
-        topo_data['ion2torus'][ion1][2])
-    print "%10s at ( %d, %d, %d )" % (node_list[1], 
-        topo_data['ion2torus'][ion2][0],
-        topo_data['ion2torus'][ion2][1],
-        topo_data['ion2torus'][ion2][2])
-    print "%d hops" % hops
+        print( "%d hops" % hops )
 
 ### calculate_hop_distribution: Given a list of nodes (gcn-XX-YY), calculate 
 ###   the hop distances between all possible node pairs and print some basic 
 ###   statistics
-def calculate_hop_distribution(node_list, topo_data):
-    node_pair_list = []
-   
-    # build a list of all non-redundant node pairs
-    for i in range(len(node_list)-1):
-        for j in range(i+1, len(node_list)):
+def calculate_hop_distribution(node_list, topo):
+    try:
+        topo.check_nodes(node_list)
+        histogram = topo.histogram(node_list)
+    except KeyError as e:
+        sys.stderr.write('Invalid node: %s\n' % e.args[0])
+        sys.exit(1)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+
+    topology.print_hop_histogram(histogram, len(node_list))
+
+### calculate_batch_hops: print hop statistics for every job in a qstat -x
+###   dump (or a file of "jobid exec_host" lines) as CSV or as JSON, one job
+###   per line
+def calculate_batch_hops(fp, topo, output_format='csv'):
+    if output_format == 'csv':
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow([ 'jobid', 'nodes', 'pairs', 'max_hops', 'mean_hops',
+                          'histogram' ])
+
+    for jobid, node_list in iter_batch_jobs(fp):
+        try:
+            topo.check_nodes(node_list)
+            histogram = topo.histogram(node_list)
+        except KeyError as e:
+            sys.stderr.write('Skipping job %s: invalid node %s\n'
+                % ( jobid, e.args[0] ))
+            continue
+        except ValueError as e:
+            sys.stderr.write('Skipping job %s: %s\n' % ( jobid, e ))
+            continue
+
+        pairs = sum(histogram)
+        if pairs:
+            mean_hops = float(sum([ hops * count for hops, count
+                                    in enumerate(histogram) ])) / pairs
+        else:
+            mean_hops = 0.0
+
+        if output_format == 'json':
+            sys.stdout.write(json.dumps({
+                'jobid':        jobid,
+                'nodes':        len(node_list),
+                'pairs':        pairs,
+                'max_hops':     len(histogram) - 1,
+                'mean_hops':    round(mean_hops, 4),
+                'histogram':    histogram }, sort_keys=True) + '\n')
+        else:
+            writer.writerow([ jobid, len(node_list), pairs, len(histogram) - 1,
+                              '%.4f' % mean_hops,
+                              ' '.join([ str(x) for x in histogram ]) ])
+
+### iter_batch_jobs: yield ( jobid, node list ) for each job with an exec_host
+###   in fp.  XML from qstat -x is parsed incrementally and each job element is
+###   discarded once read, so arbitrarily large dumps use constant memory
+def iter_batch_jobs(fp):
+    first_line = fp.readline()
+    while first_line and not first_line.strip():
+        first_line = fp.readline()
+
+    if first_line.lstrip().startswith('<'):
+        source = _PrependedFile(first_line, fp)
+        for event, elem in torque_xml.iterparse(source):
+            if elem.tag != 'Job':
+                continue
+            exec_host = elem.findtext('exec_host')
+            if exec_host:
+                yield elem.findtext('Job_Id'), get_exec_host_nodes(exec_host)
+            elem.clear()
+    else:
+        line = first_line
+        while line:
+            fields = line.split()
+            if len(fields) > 1:
+                yield fields[0], get_exec_host_nodes('+'.join(fields[1:]))
+            line = fp.readline()
+
+### get_exec_host_nodes: turn an exec_host string (gcn-1-11/0+gcn-1-11/1+...)
+###   into a list of unique node names, preserving their order
+def get_exec_host_nodes(exec_host):
+    node_list = []
+    seen = set()
+    for host in exec_host.split('+'):
+        node = host.split('/', 1)[0].strip()
+        if node and node not in seen:
+            seen.add(node)
+            node_list.append(node)
+    return node_list
+
+class _PrependedFile:
+    'File-like wrapper that replays a line already consumed from fp'
+
+    def __init__(self, head, fp):
+        self.head = head
+        self.fp = fp
+
+    def read(self, size=-1):
+        if self.head:
+            data, self.head = self.head, None
+            return data
+        return self.fp.read(size)
+
+### select_nodes_main: parse arguments for --select and print the chosen nodes
+def select_nodes_main(args, faults_file=None):
+    try:
+        n_nodes = int(args[0])
+    except ValueError:
+        n_nodes = 0
+    if n_nodes < 1:
+        sys.stderr.write('--select needs a positive node count, not %s\n'
+            % args[0])
+        sys.exit(1)
+    objective = 'max'
+    free_nodes = args[1:]
+    if free_nodes and free_nodes[0] == '--mean':
+        objective = 'mean'
+        free_nodes = free_nodes[1:]
+    if not free_nodes:
+        free_nodes = [ line.split()[0] for line in sys.stdin if line.strip() ]
+
+    topo = load_topology(faults_file)
+    try:
+        selected = select_nodes(free_nodes, n_nodes, topo, objective)
+    except KeyError as e:
+        sys.stderr.write('Invalid node: %s\n' % e.args[0])
+        sys.exit(1)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+
+    histogram = topo.histogram(selected)
+    pairs = sum(histogram)
+    mean_hops = 0.0
+    if pairs:
+        mean_hops = float(sum([ hops * count for hops, count
+                                in enumerate(histogram) ])) / pairs
+    sys.stderr.write('Selected %d nodes: max hops %d, mean hops %.3f\n'
+        % ( len(selected), len(histogram) - 1, mean_hops ))
+    for node in selected:
+        sys.stdout.write('%s\n' % node)
+
+### select_nodes: choose n_nodes from free_nodes so that either the maximum
+###   ('max') or the mean ('mean') hop distance between them is small.  Nodes
+###   are handled per ION since all nodes behind an ION are equivalent.  From
+###   every ION in turn, grow a set of IONs by repeatedly adding the ION that
+###   is closest to those already chosen, then keep the best of these sets.
+###   For 'max', each seed is also grown as a ball, with ties going to the ION
+###   closest to the seed, which keeps the set from stretching out along one
+###   dimension.  Nodes behind failed IONs are never selected
+def select_nodes(free_nodes, n_nodes, topo, objective='max'):
+    failed_ions = set([ topo.ion_index[ion] for ion in topo.failed_ions ])
+    free_nodes = [ node for node in free_nodes
+                   if topo.ions(node) not in failed_ions ]
+    if n_nodes < 1 or n_nodes > len(set(free_nodes)):
+        raise ValueError('Cannot select %d nodes from %d free nodes'
+            % ( n_nodes, len(set(free_nodes)) ))
+
+    free_by_ion = {}
+    for node in free_nodes:
+        ion_nodes = free_by_ion.setdefault(topo.ions(node), [])
+        if node not in ion_nodes:
+            ion_nodes.append(node)
+    ions = sorted(free_by_ion.keys())
+    n_free = [ len(free_by_ion[ion]) for ion in ions ]
+    hop_table = topo.endpoint_table(ions)
+    # IONs that faults have disconnected from each other are infinitely far
+    unreachable = n_nodes * len(hop_table) ** 2
+    hop_table = [ [ hops if hops >= 0 else unreachable for hops in row ]
+                  for row in hop_table ]
+
+    best = None
+    # ties in max hops go to the fewest total hops, or with ball to the ION
+    # nearest the seed
+    balls = ( False, ) if objective == 'mean' else ( False, True )
+    for seed, ball in [ ( seed, ball ) for seed in range(len(ions))
+                        for ball in balls ]:
+        max_hops = [ 0 ] * len(ions)    # farthest chosen ION from each ION
+        sum_hops = [ 0 ] * len(ions)    # node-weighted hops to chosen nodes
+        taken = [ 0 ] * len(ions)
+        remaining = n_nodes
+        cost = 0
+        worst = 0
+        pick = seed
+        while True:
+            take = min(remaining, n_free[pick])
+            cost += take * sum_hops[pick]
+            worst = max(worst, max_hops[pick])
+            taken[pick] = take
+            remaining -= take
+            if not remaining:
+                break
+            for ion in range(len(ions)):
+                hops = hop_table[pick][ion]
+                if hops > max_hops[ion]:
+                    max_hops[ion] = hops
+                sum_hops[ion] += take * hops
+
+            candidates = [ ion for ion in range(len(ions)) if not taken[ion] ]
+            if objective == 'mean':
+                pick = min(candidates, key=lambda ion:
+                    ( sum_hops[ion], max_hops[ion], -n_free[ion] ))
+            else:
+                pick = min(candidates, key=lambda ion:
+                    ( max_hops[ion], hop_table[seed][ion] if ball else 0,
+                      sum_hops[ion], -n_free[ion] ))
+
+        if objective == 'mean':
+            score = ( cost, worst )
+        else:
+            score = ( worst, cost )
+        if best is None or score < best[0]:
+            best = ( score, taken )
+
+    selected = []
+    for ion, take in enumerate(best[1]):
+        selected.extend(free_by_ion[ions[ion]][:take])
+    return selected
+
+### parse_intermixed: parse args with an argparse parser, letting node names
+###   come before, between and after options where argparse can (Python 3.7
+###   and later)
+def parse_intermixed(parser, args):
+    if hasattr(parser, 'parse_intermixed_args'):
+        return parser.parse_intermixed_args(args)
+    return parser.parse_args(args)
+
+### positive_int: argparse type for a count that must be at least one
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, not %s' % text)
+    return value
+
+### congestion_main: parse arguments for --congestion and print the report
+def congestion_main(prog, args, faults_file=None):
+    import numpy as np
+    parser = argparse.ArgumentParser(prog='%s --congestion' % prog,
+        description='Route a job\'s traffic over the torus with dimension-'
+            'ordered routing and report per-link load')
+    parser.add_argument('nodes', nargs='*',
+        help='nodes running the job, in rank order (default: read from stdin)')
+    parser.add_argument('--pattern', choices=[ 'alltoall', 'neighbor' ],
+        default='alltoall', help='traffic between ranks (default: alltoall)')
+    parser.add_argument('--matrix', metavar='FILE',
+        help='read "src_rank dst_rank bytes" lines instead of using --pattern')
+    parser.add_argument('--bytes', type=float, default=1.0,
+        help='bytes sent per rank pair by --pattern (default: 1)')
+    parser.add_argument('--ppn', type=positive_int, default=1,
+        help='consecutive ranks placed on each node (default: 1)')
+    parser.add_argument('--top', type=int, default=10,
+        help='number of hottest links to list (default: 10)')
+    options = parse_intermixed(parser, args)
+
+    node_list = options.nodes
+    if not node_list:
+        node_list = [ line.split()[0] for line in sys.stdin if line.strip() ]
+
+    topo = load_topology(faults_file)
+    try:
+        rank_ion = get_rank_ions(node_list, options.ppn, topo)
+    except KeyError as e:
+        sys.stderr.write('Invalid node: %s\n' % e.args[0])
+        sys.exit(1)
+
+    if options.matrix:
+        try:
+            src, dst, nbytes = read_traffic_matrix(options.matrix)
+        except (IOError, ValueError) as e:
+            sys.stderr.write('%s\n' % e)
+            sys.exit(1)
+        if max(src.max(), dst.max()) >= len(rank_ion):
+            sys.stderr.write('Traffic matrix has more ranks than the %d '
+                'placed on the given nodes\n' % len(rank_ion))
+            sys.exit(1)
+        ion_bytes, ion_flows = get_ion_traffic(rank_ion, src, dst, nbytes,
+            len(topo.ion_names))
+    elif options.pattern == 'alltoall':
+        ion_bytes, ion_flows = get_alltoall_traffic(rank_ion, options.bytes,
+            len(topo.ion_names))
+    else:
+        src, dst = get_ring_pairs(len(rank_ion))
+        ion_bytes, ion_flows = get_ion_traffic(rank_ion, src, dst,
+            np.ones(len(src)) * options.bytes, len(topo.ion_names))
+
+    print_congestion(rank_ion, ion_bytes, ion_flows, topo, options.top)
+
+### get_rank_ions: index into topo.ion_names of the ION serving each rank when
+###   ppn consecutive ranks run on each node in node_list
+def get_rank_ions(node_list, ppn, topo):
+    import numpy as np
+    return np.repeat(np.asarray(topo.ions(node_list), dtype=int), ppn)
+
+### get_ring_pairs: ( src, dst ) rank arrays in which each rank talks to both
+###   of its neighbors on a ring.  A ring of two has one pair of neighbors, not
+###   two
+def get_ring_pairs(n_ranks):
+    import numpy as np
+    ranks = np.arange(n_ranks)
+    src, dst = ranks, (ranks + 1) % n_ranks
+    if n_ranks > 2:
+        src = np.concatenate((ranks, ranks))
+        dst = np.concatenate(((ranks + 1) % n_ranks, (ranks - 1) % n_ranks))
+    keep = src != dst
+    return src[keep], dst[keep]
+
+### get_ion_traffic: collapse rank-to-rank traffic into the bytes and the
+###   number of rank pairs (flows) between every pair of IONs, as flattened
+###   n_ions x n_ions arrays
+def get_ion_traffic(rank_ion, src, dst, nbytes, n_ions):
+    import numpy as np
+    ion_pair = rank_ion[src] * n_ions + rank_ion[dst]
+    return np.bincount(ion_pair, weights=nbytes, minlength=n_ions**2), \
+        np.bincount(ion_pair, minlength=n_ions**2)
+
+### get_alltoall_traffic: get_ion_traffic for every rank sending nbytes to
+###   every other rank.  The rank pairs between two IONs are counted at once
+###   as the product of their rank counts, so memory does not grow with the
+###   square of the number of ranks
+def get_alltoall_traffic(rank_ion, nbytes, n_ions):
+    import numpy as np
+    counts = np.bincount(rank_ion, minlength=n_ions)
+    ion_flows = np.outer(counts, counts)
+    np.fill_diagonal(ion_flows, counts * (counts - 1))
+    ion_flows = ion_flows.ravel()
+    return ion_flows * float(nbytes), ion_flows
+
+### read_traffic_matrix: read a sparse rank-to-rank byte matrix made of
+###   "src_rank dst_rank bytes" lines.  Ranks must be non-negative integers
+def read_traffic_matrix(matrix_file):
+    import numpy as np
+    with warnings.catch_warnings():
+        # an empty file is reported below rather than as a numpy warning
+        warnings.simplefilter('ignore')
+        data = np.loadtxt(matrix_file, ndmin=2, comments='#')
+    if data.size == 0:
+        raise ValueError('%s: no "src dst bytes" lines' % matrix_file)
+    if data.shape[1] != 3:
+        raise ValueError('%s: expected "src dst bytes" lines' % matrix_file)
+    ranks = data[:, :2]
+    bad = ~((ranks >= 0) & (ranks == np.floor(ranks)))
+    if bad.any():
+        raise ValueError('%s: rank %g is not a non-negative integer'
+            % ( matrix_file, float(ranks[bad][0]) ))
+    return data[:, 0].astype(int), data[:, 1].astype(int), data[:, 2]
+
+### get_link_loads: route ION-to-ION traffic, as from get_ion_traffic, over
+###   the torus.  Returns the bytes and the number of rank pairs crossing each
+###   directed link, indexed as described in torus_routes
+def get_link_loads(ion_bytes, ion_flows, topo):
+    import numpy as np
+    n_ions = len(topo.ion_names)
+
+    # traffic within an ION never touches the torus
+    flows = np.nonzero(ion_flows)[0]
+    flows = flows[flows // n_ions != flows % n_ions]
+
+    coords = topo.array('ion_coords')
+    flow, link = torus_routes(coords[flows // n_ions], coords[flows % n_ions],
+        topo.torus_size)
+    n_links = int(np.prod(topo.torus_size)) * 2 * coords.shape[1]
+    link_bytes = np.bincount(link, weights=ion_bytes[flows][flow],
+        minlength=n_links)
+    link_flows = np.bincount(link, weights=ion_flows[flows][flow],
+        minlength=n_links)
+    return link_bytes, link_flows
+
+### print_congestion: print a summary of link loads and the hottest links
+def print_congestion(rank_ion, ion_bytes, ion_flows, topo, top=10):
+    import numpy as np
+    link_bytes, link_flows = get_link_loads(ion_bytes, ion_flows, topo)
+    used = link_bytes > 0
+
+    print( 'Ranks:                %d on %d IONs'
+        % ( len(rank_ion), len(np.unique(rank_ion)) ) )
+    print( 'Total bytes:          %.6g' % ion_bytes.sum() )
+    print( 'Links used:           %d of %d' % ( used.sum(), len(link_bytes) ) )
+    if not used.any():
+        return
+    mean_bytes = link_bytes[used].mean()
+    print( 'Mean link load:       %.6g bytes' % mean_bytes )
+    print( 'Max link load:        %.6g bytes' % link_bytes.max() )
+    print( 'Contention factor:    %.3f (max / mean link load)'
+        % ( link_bytes.max() / mean_bytes ) )
+    print( 'Max flows per link:   %d' % link_flows.max() )
+
+    print( '\nHottest links:' )
+    for link in np.argsort(-link_bytes, kind='mergesort')[:top]:
+        if not used[link]:
+            break
+        print( '  %s  %12.6g bytes  %6d flows  %6.2fx mean'
+            % ( get_link_name(link, topo), link_bytes[link],
+                link_flows[link], link_bytes[link] / mean_bytes ) )
+
+### get_link_name: describe a directed link numbered as in torus_routes by the
+###   IONs at either end and its direction, e.g. "ion-1-1 -> ion-1-2 +z"
+def get_link_name(link, topo):
+    torus_size = topo.torus_size
+    n_dims = len(torus_size)
+    position, dim, direction = \
+        link // (2 * n_dims), link // 2 % n_dims, link % 2
+    coord = torus_coords(position, torus_size)
+    neighbor = coord.copy()
+    neighbor[dim] = (neighbor[dim] + (-1 if direction else 1)) \
+        % torus_size[dim]
+    # name each torus position after the ION that sits there
+    ion_at = dict(zip(topo.ion_coords, topo.ion_names))
+    return '%10s -> %-10s %s%s' % ( ion_at[tuple(coord.tolist())],
+        ion_at[tuple(neighbor.tolist())], '-' if direction else '+',
+        _dim_name(dim, n_dims) )
+
+def _dim_name(dim, n_dims):
+    if n_dims <= 3:
+        return 'xyz'[dim]
+    return str(dim)
+
+### comm_cost_main: parse arguments for --comm-cost and print the report
+def comm_cost_main(prog, args, faults_file=None):
+    import numpy as np
+    parser = argparse.ArgumentParser(prog='%s --comm-cost' % prog,
+        description='Weight the hop distance between every pair of ranks by '
+            'the bytes they exchange')
+    parser.add_argument('--matrix', metavar='FILE', required=True,
+        help='file of "src_rank dst_rank bytes" lines, e.g. from an MPI '
+             'profiler')
+    parser.add_argument('nodes', nargs='*',
+        help='nodes running the job, in rank order (default: read from stdin)')
+    parser.add_argument('--ppn', type=positive_int, default=1,
+        help='consecutive ranks placed on each node (default: 1)')
+    parser.add_argument('--top', type=int, default=10,
+        help='number of IONs and rank pairs to list (default: 10)')
+    options = parse_intermixed(parser, args)
+
+    node_list = options.nodes
+    if not node_list:
+        node_list = [ line.split()[0] for line in sys.stdin if line.strip() ]
+
+    topo = load_topology(faults_file)
+    try:
+        rank_ion = get_rank_ions(node_list, options.ppn, topo)
+        src, dst, nbytes = read_traffic_matrix(options.matrix)
+    except KeyError as e:
+        sys.stderr.write('Invalid node: %s\n' % e.args[0])
+        sys.exit(1)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+    if max(src.max(), dst.max()) >= len(rank_ion):
+        sys.stderr.write('Traffic matrix has more ranks than the %d '
+            'placed on the given nodes\n' % len(rank_ion))
+        sys.exit(1)
+
+    rank_nodes = np.repeat(np.array(node_list, dtype=object), options.ppn)
+    try:
+        print_comm_cost(rank_ion, src, dst, nbytes, rank_nodes, topo,
+            options.top)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+
+### get_ion_hop_table: hop distances between every pair of IONs as an integer
+###   array indexed like topo.ion_names (-1 where faults leave no path)
+def get_ion_hop_table(topo):
+    import numpy as np
+    return np.asarray(topo.endpoint_hops(), dtype=int)
+
+### get_comm_cost: weight the hop distance of every entry of a sparse
+###   rank-to-rank traffic matrix by its bytes.  Repeated ( src, dst ) entries
+###   are summed.  Returns a dict of the matrix's ( src, dst, bytes, hops ),
+###   each rank pair's cost (bytes x hops), the bytes carried at each hop
+###   distance, the bytes each ION sends to and receives from other IONs and
+###   keeps local, and the mean hop distance over all rank pairs regardless
+###   of traffic.  Raises ValueError if faults leave some pair without a path
+def get_comm_cost(rank_ion, src, dst, nbytes, topo):
+    import numpy as np
+    n_ranks = len(rank_ion)
+    n_ions = len(topo.ion_names)
+    ion_hops = get_ion_hop_table(topo)
+
+    pair, inverse = np.unique(src * n_ranks + dst, return_inverse=True)
+    nbytes = np.bincount(inverse.ravel(), weights=nbytes, minlength=len(pair))
+    src, dst = pair // n_ranks, pair % n_ranks
+    src_ion, dst_ion = rank_ion[src], rank_ion[dst]
+    hops = ion_hops[src_ion, dst_ion]
+    if (hops < 0).any():
+        bad = np.nonzero(hops < 0)[0][0]
+        raise ValueError('No path between ranks %d and %d' % ( src[bad],
+            dst[bad] ))
+
+    remote = np.where(hops > 0, nbytes, 0.0)
+    counts = np.bincount(rank_ion, minlength=n_ions).astype(float)
+    n_pairs = n_ranks * (n_ranks - 1)
+    return {
+        'src':          src,
+        'dst':          dst,
+        'bytes':        nbytes,
+        'hops':         hops,
+        'cost':         nbytes * hops,
+        'hop_bytes':    np.bincount(hops, weights=nbytes, minlength=1),
+        'ion_sent':     np.bincount(src_ion, weights=remote, minlength=n_ions),
+        'ion_received': np.bincount(dst_ion, weights=remote, minlength=n_ions),
+        'ion_local':    np.bincount(src_ion, weights=nbytes - remote,
+                            minlength=n_ions),
+        'pair_hops':    np.dot(counts, np.dot(np.maximum(ion_hops, 0), counts))
+                            / n_pairs if n_pairs else 0.0,
+    }
+
+### print_comm_cost: print the byte-weighted hop cost of a job's traffic,
+###   the IONs moving the most of it and the rank pairs whose traffic costs
+###   the most
+def print_comm_cost(rank_ion, src, dst, nbytes, rank_nodes, topo, top=10):
+    import numpy as np
+    cost = get_comm_cost(rank_ion, src, dst, nbytes, topo)
+    total = cost['bytes'].sum()
+    remote = cost['bytes'][cost['hops'] > 0].sum()
+
+    print( 'Ranks:                %d on %d IONs'
+        % ( len(rank_ion), len(np.unique(rank_ion)) ) )
+    print( 'Rank pairs talking:   %d' % len(cost['src']) )
+    print( 'Total bytes:          %.6g' % total )
+    if not total:
+        return
+    print( 'Bytes between IONs:   %.6g (%.1f%%)' % ( remote,
+        100.0 * remote / total ) )
+    print( 'Byte-weighted cost:   %.6g byte-hops' % cost['cost'].sum() )
+    print( 'Mean hops per byte:   %.3f' % ( cost['cost'].sum() / total ) )
+    print( 'Mean hops per pair:   %.3f (all rank pairs, unweighted)'
+        % cost['pair_hops'] )
+
+    print( '\nBytes by hop distance:' )
+    for hops, hop_bytes in enumerate(cost['hop_bytes']):
+        print( '  %2d hops: %12.6g bytes  %5.1f%%' % ( hops, hop_bytes,
+            100.0 * hop_bytes / total ) )
+
+    ion_list = topo.ion_names
+    moved = cost['ion_sent'] + cost['ion_received']
+    print( '\nBusiest IONs:\n  %-10s %12s %12s %12s' % ( '', 'sent bytes',
+        'received', 'local' ) )
+    for ion in np.argsort(-moved, kind='mergesort')[:top]:
+        if not moved[ion]:
+            break
+        print( '  %-10s %12.6g %12.6g %12.6g' % ( ion_list[ion],
+            cost['ion_sent'][ion], cost['ion_received'][ion],
+            cost['ion_local'][ion] ) )
+
+    print( '\nWorst-placed rank pairs:' )
+    for i in np.argsort(-cost['cost'], kind='mergesort')[:top]:
+        if not cost['cost'][i]:
+            break
+        print( '  %6d -> %-6d %10s -> %-10s %2d hops  %12.6g bytes  '
+            '%12.6g byte-hops' % ( cost['src'][i], cost['dst'][i],
+                rank_nodes[cost['src'][i]], rank_nodes[cost['dst'][i]],
+                cost['hops'][i], cost['bytes'][i], cost['cost'][i] ) )
+
+### reorder_main: parse arguments for --reorder and print a hostfile (or Open
+###   MPI rankfile) that places a job's logical ranks on the given nodes
+def reorder_main(prog, args, faults_file=None):
+    import numpy as np
+    parser = argparse.ArgumentParser(prog='%s --reorder' % prog,
+        description='Order the ranks of a job over its nodes so that ranks '
+            'that talk to each other sit close together on the torus')
+    parser.add_argument('nodes', nargs='*',
+        help='nodes allocated to the job, in the scheduler\'s order (default: '
+             'read from stdin)')
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument('--grid', metavar='XxYxZ',
+        help='ranks form a 1D, 2D or 3D stencil of these dimensions, rank '
+             'numbers varying fastest along the last')
+    layout.add_argument('--ring', action='store_true',
+        help='each rank talks to the next and previous one (the default)')
+    layout.add_argument('--matrix', metavar='FILE',
+        help='read the communication graph as "src_rank dst_rank bytes" '
+             'lines')
+    parser.add_argument('--periodic', action='store_true',
+        help='--grid wraps around in every dimension')
+    parser.add_argument('--ppn', type=positive_int, default=1,
+        help='ranks on each node (default: 1)')
+    parser.add_argument('--rankfile', action='store_true',
+        help='print an Open MPI rankfile instead of one node per rank')
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help='write the hostfile to FILE instead of stdout')
+    options = parse_intermixed(parser, args)
+
+    node_list = options.nodes
+    if not node_list:
+        node_list = [ line.split()[0] for line in sys.stdin if line.strip() ]
+
+    topo = load_topology(faults_file)
+    try:
+        topo.check_nodes(node_list)
+        slot_ion = get_rank_ions(node_list, options.ppn, topo)
+        n_ranks = len(slot_ion)
+        if options.matrix:
+            src, dst, nbytes = read_traffic_matrix(options.matrix)
+            if max(src.max(), dst.max()) >= n_ranks:
+                raise ValueError('Traffic matrix has more ranks than the %d '
+                    'placed on the given nodes' % n_ranks)
+        elif options.grid:
+            dims = [ int(x) for x in options.grid.split('x') ]
+            if int(np.prod(dims)) != n_ranks:
+                raise ValueError('A %s grid needs %d ranks, not the %d placed '
+                    'on the given nodes' % ( options.grid, np.prod(dims),
+                        n_ranks ))
+            src, dst = get_grid_pairs(dims, options.periodic)
+            nbytes = np.ones(len(src))
+        else:
+            src, dst = get_ring_pairs(n_ranks)
+            nbytes = np.ones(len(src))
+        rank_slot = reorder_ranks(slot_ion, src, dst, nbytes,
+            get_ion_hop_table(topo))
+        before = get_comm_cost(slot_ion, src, dst, nbytes, topo)
+        after = get_comm_cost(slot_ion[rank_slot], src, dst, nbytes, topo)
+    except KeyError as e:
+        sys.stderr.write('Invalid node: %s\n' % e.args[0])
+        sys.exit(1)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+
+    total = before['bytes'].sum() or 1.0
+    cost_before, cost_after = before['cost'].sum(), after['cost'].sum()
+    if cost_after > cost_before:
+        # the greedy order can lose to a scheduler that already did well
+        rank_slot, after, cost_after = np.arange(n_ranks), before, cost_before
+    sys.stderr.write('Reordered %d ranks on %d nodes: mean hops per byte '
+        '%.3f -> %.3f, max partner hops %d -> %d (%.1f%% less byte-weighted '
+        'cost)\n' % ( n_ranks, len(node_list), cost_before / total,
+            cost_after / total, before['hops'].max() if len(src) else 0,
+            after['hops'].max() if len(src) else 0,
+            100.0 * (cost_before - cost_after) / cost_before
+                if cost_before else 0.0 ))
+
+    slot_node = np.repeat(np.arange(len(node_list)), options.ppn)
+    slot_core = np.tile(np.arange(options.ppn), len(node_list))
+    if options.rankfile:
+        lines = [ 'rank %d=%s slot=%d\n' % ( rank, node_list[slot_node[slot]],
+                      slot_core[slot] )
+                  for rank, slot in enumerate(rank_slot.tolist()) ]
+    else:
+        lines = [ node_list[slot_node[slot]] + '\n'
+                  for slot in rank_slot.tolist() ]
+    if options.output:
+        with open(options.output, 'w') as fp:
+            fp.writelines(lines)
+    else:
+        sys.stdout.writelines(lines)
+
+### get_grid_pairs: ( src, dst ) rank arrays linking every rank of a stencil
+###   of the given dimensions to its neighbors in each dimension, both ways.
+###   Ranks are numbered in C order; periodic grids wrap around
+def get_grid_pairs(dims, periodic=False):
+    import numpy as np
+    ranks = np.arange(int(np.prod(dims))).reshape(dims)
+    src, dst = [], []
+    for dim, size in enumerate(dims):
+        if size < 2:
+            continue
+        neighbor = np.roll(ranks, -1, axis=dim)
+        if periodic:
+            a, b = ranks, neighbor
+        else:
+            a = np.delete(ranks, -1, axis=dim)
+            b = np.delete(neighbor, -1, axis=dim)
+        if size == 2 and periodic:
+            # a ring of two has one link, not two
+            a = np.delete(a, -1, axis=dim)
+            b = np.delete(b, -1, axis=dim)
+        src.extend([ a.ravel(), b.ravel() ])
+        dst.extend([ b.ravel(), a.ravel() ])
+    if not src:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    return np.concatenate(src), np.concatenate(dst)
+
+### reorder_ranks: map logical ranks onto the slots of an allocation, where
+###   slot_ion gives the ION behind each slot.  Slots behind one ION are all
+###   alike, so ranks are assigned to IONs with as many ranks as slots.  Ranks
+###   are placed one at a time, always taking next the unplaced rank that
+###   exchanges the most bytes with ranks already placed, and put behind the
+###   ION with room that minimizes its bytes x hops to them (ties going to
+###   the ION closest to the whole allocation).  Each ION's slots are then
+###   handed out in order, so ranks placed in a row share nodes.  Returns the
+###   slot of every rank
+def reorder_ranks(slot_ion, src, dst, nbytes, ion_hops):
+    import numpy as np
+    n_ranks = len(slot_ion)
+    ions, slot_bin = np.unique(slot_ion, return_inverse=True)
+    slot_bin = slot_bin.ravel()
+    capacity = np.bincount(slot_bin, minlength=len(ions))
+    hops = np.asarray(ion_hops)[np.ix_(ions, ions)].astype(float)
+    # IONs that faults cut off from each other are as far apart as can be
+    hops[hops < 0] = hops.max() + len(ions)
+    central = np.dot(hops, capacity)
+
+    # symmetric communication graph in compressed sparse row form
+    a = np.concatenate((src, dst))
+    b = np.concatenate((dst, src))
+    w = np.concatenate((nbytes, nbytes)).astype(float)
+    order = np.argsort(a, kind='mergesort')
+    b, w = b[order], w[order]
+    indptr = np.searchsorted(a[order], np.arange(n_ranks + 1))
+
+    rank_bin = np.full(n_ranks, -1, dtype=int)
+    affinity = np.zeros(n_ranks)
+    heap = [ ( 0.0, rank ) for rank in range(n_ranks) ]
+    while heap:
+        key, rank = heapq.heappop(heap)
+        if rank_bin[rank] >= 0 or -key != affinity[rank]:
+            continue
+        partners = b[indptr[rank]:indptr[rank + 1]]
+        weights = w[indptr[rank]:indptr[rank + 1]]
+        placed = rank_bin[partners] >= 0
+        cost = np.dot(weights[placed], hops[rank_bin[partners[placed]]])
+        free = np.nonzero(capacity)[0]
+        free = free[np.lexsort(( central[free], cost[free] ))]
+        rank_bin[rank] = free[0]
+        capacity[free[0]] -= 1
+
+        waiting = ~placed & (partners != rank)
+        for partner, weight in zip(partners[waiting].tolist(),
+                                   weights[waiting].tolist()):
+            affinity[partner] += weight
+            heapq.heappush(heap, ( -affinity[partner], partner ))
+
+    # hand out each ION's slots to its ranks in the order they were placed
+    placement = np.argsort(rank_bin, kind='mergesort')
+    slots = np.argsort(slot_bin, kind='mergesort')
+    rank_slot = np.empty(n_ranks, dtype=int)
+    rank_slot[placement] = slots
+    return rank_slot
+
+### interference_main: parse arguments for --interference and print the report
+def interference_main(prog, args, faults_file=None):
+    parser = argparse.ArgumentParser(prog='%s --interference' % prog,
+        description='Route the traffic of every running job over the torus '
+            'at once and report the links and IONs that jobs share')
+    parser.add_argument('inputs', nargs='*',
+        help='qstat -x dumps or files of "jobid exec_host" lines (default: '
+             'stdin)')
+    parser.add_argument('--pattern', choices=[ 'alltoall', 'neighbor' ],
+        default='alltoall', help='traffic between the nodes of each job '
+                                 '(default: alltoall)')
+    parser.add_argument('--top', type=int, default=10,
+        help='number of links, IONs and jobs to list (default: 10)')
+    options = parse_intermixed(parser, args)
+
+    topo = load_topology(faults_file)
+    jobids, job_ions = [], []
+    try:
+        for input_file in options.inputs or [ None ]:
+            fp = sys.stdin if input_file is None else open(input_file, 'r')
             try:
-                node_data = {
-                    'pairs':    ( node_list[i], node_list[j] ),
-                    'ions':     ( topo_data['compute2ion'][node_list[i]],
-                                topo_data['compute2ion'][node_list[j]] )
-                }
-            except KeyError:
-                sys.stderr.write('Invalid node pair: %s,%s\n' 
-                    % ( node_list[i], node_list[j] ))
-                sys.exit(1)
+                for jobid, node_list in iter_batch_jobs(fp):
+                    try:
+                        job_ions.append(get_rank_ions(node_list, 1, topo))
+                    except KeyError as e:
+                        sys.stderr.write('Skipping job %s: invalid node %s\n'
+                            % ( jobid, e.args[0] ))
+                        continue
+                    jobids.append(jobid)
+            finally:
+                if fp is not sys.stdin:
+                    fp.close()
+    except (IOError, OSError, ElementTree.ParseError) as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
 
-            node_data['pos'] =( topo_data['ion2torus'][node_data['ions'][0]],
-                                topo_data['ion2torus'][node_data['ions'][1]] )
+    print_interference(jobids, job_ions, options.pattern, topo, options.top)
 
-            node_pair_list.append( node_data )
+### get_job_link_loads: route the traffic of many jobs over the torus in one
+###   pass.  job_ions holds, for each job, the index into ion_names of the ION
+###   behind each of its nodes; every pair of nodes (alltoall) or ring
+###   neighbors (neighbor) exchanges one flow.  Each ION pair used by any job
+###   is routed once, and a job x route incidence product gives every job's
+###   flows on every directed link (numbered as in torus_routes).  Returns
+###   ( job_links, job_nodes ), arrays of each job's flows per link and nodes
+###   behind each ION
+def get_job_link_loads(job_ions, pattern, topo):
+    import numpy as np
+    n_ions = len(topo.ion_names)
+    n_jobs = len(job_ions)
+    job_nodes = np.zeros((n_jobs, n_ions))
+    job_flows = np.zeros((n_jobs, n_ions * n_ions))
+    for job, rank_ion in enumerate(job_ions):
+        counts = np.bincount(rank_ion, minlength=n_ions)
+        job_nodes[job] = counts
+        if pattern == 'alltoall':
+            job_flows[job] = np.outer(counts, counts).ravel()
+        else:
+            src, dst = get_ring_pairs(len(rank_ion))
+            job_flows[job] = np.bincount(rank_ion[src] * n_ions + rank_ion[dst],
+                minlength=n_ions * n_ions)
 
-    # calculate hop distance between each node pair
-    hop_count = [0] * len(node_pair_list)
-    for index, value in enumerate(node_pair_list):
-        hops = get_hops( value['pos'][0], value['pos'][1], 
-            topo_data['torus_size'] )
-        hop_count[index] = hops
+    # traffic within an ION never touches the torus
+    used = np.nonzero(job_flows.any(axis=0))[0]
+    used = used[used // n_ions != used % n_ions]
+    coords = topo.array('ion_coords')
+    flow, link = torus_routes(coords[used // n_ions], coords[used % n_ions],
+        topo.torus_size)
+    n_links = int(np.prod(topo.torus_size)) * 2 * coords.shape[1]
+    routes = np.bincount(flow * n_links + link,
+        minlength=len(used) * n_links).reshape(len(used), n_links)
+    return np.dot(job_flows[:, used], routes), job_nodes
 
-    val, idx = ( max(hop_count), hop_count.index(max(hop_count)) )
-    n1, n2 = ( node_pair_list[idx]['pairs'][0], node_pair_list[idx]['pairs'][1] )
-    print "Max hops: %d"  % ( val )
+### print_interference: print which jobs share torus links and IONs, the most
+###   shared links and IONs, and for the most exposed jobs how much of their
+###   traffic crosses links that other jobs also load
+def print_interference(jobids, job_ions, pattern, topo, top=10):
+    import numpy as np
+    n_nodes = sum([ len(rank_ion) for rank_ion in job_ions ])
+    print( 'Jobs:                 %d on %d nodes' % ( len(jobids), n_nodes ) )
+    if not jobids:
+        return
+    job_links, job_nodes = get_job_link_loads(job_ions, pattern, topo)
+    link_jobs = (job_links > 0).sum(axis=0)
+    link_flows = job_links.sum(axis=0)
+    ion_jobs = (job_nodes > 0).sum(axis=0)
+    print( 'Links used:           %d of %d, %d by more than one job'
+        % ( (link_jobs > 0).sum(), len(link_jobs), (link_jobs > 1).sum() ) )
+    print( 'IONs used:            %d of %d, %d by more than one job'
+        % ( (ion_jobs > 0).sum(), len(ion_jobs), (ion_jobs > 1).sum() ) )
 
-    histogram = [0] * (val + 1)
+    def shares(loads):
+        order = np.argsort(-loads, kind='mergesort')
+        order = order[loads[order] > 0]
+        return ', '.join([ '%s (%.0f%%)' % ( jobids[job],
+            100.0 * loads[job] / loads.sum() ) for job in order[:4] ]) \
+            + (' and %d more' % (len(order) - 4) if len(order) > 4 else '')
 
-    for hop in hop_count:
-        histogram[hop] += 1
+    shared = np.nonzero(link_jobs > 1)[0]
+    if len(shared):
+        print( '\nMost shared links:\n  %27s %5s %10s  %s' % ( '', 'jobs',
+            'flows', 'share of flows' ) )
+        for link in shared[np.lexsort(( -link_flows[shared],
+                                        -link_jobs[shared] ))][:top]:
+            print( '  %s %5d %10d  %s' % ( get_link_name(link, topo),
+                link_jobs[link], link_flows[link], shares(job_links[:, link]) ))
 
-    for index, value in enumerate(histogram):
-        print "%2d hops: %d pairs" % ( index, histogram[index] )
+    shared = np.nonzero(ion_jobs > 1)[0]
+    if len(shared):
+        ion_nodes = job_nodes.sum(axis=0)
+        print( '\nMost shared IONs:\n  %-10s %5s %6s  %s' % ( '', 'jobs',
+            'nodes', 'share of nodes' ) )
+        for ion in shared[np.lexsort(( -ion_nodes[shared],
+                                       -ion_jobs[shared] ))][:top]:
+            print( '  %-10s %5d %6d  %s' % ( topo.ion_names[ion],
+                ion_jobs[ion], ion_nodes[ion], shares(job_nodes[:, ion]) ))
 
-    print "Sum:      %d pairs between %d nodes" \
-        % ( sum(histogram), len(node_list) )
+    # overlap[a, b]: flows of other job b on the links that carry job a's
+    # traffic, weighted by how much of job a's traffic each link carries
+    own = job_links.sum(axis=1)
+    overlap = np.dot(job_links, job_links.T)
+    np.fill_diagonal(overlap, 0)
+    exposed = np.nonzero(overlap.any(axis=1))[0]
+    if not len(exposed):
+        return
+    exposure = overlap.sum(axis=1)
+    shared_flows = np.dot(job_links, link_jobs > 1)
+    print( '\nMost exposed jobs:\n  %-24s %5s %6s %9s %13s  %s' % ( '', 'nodes',
+        'links', 'shared', 'others/flow', 'share of overlap' ) )
+    for job in exposed[np.argsort(-exposure[exposed] / own[exposed],
+                                  kind='mergesort')][:top]:
+        print( '  %-24s %5d %6d %8.1f%% %13.2f  %s' % ( jobids[job],
+            len(job_ions[job]), (job_links[job] > 0).sum(),
+            100.0 * shared_flows[job] / own[job], exposure[job] / own[job],
+            shares(overlap[job]) ))
 
 ### get_gordon_topology: generate maps linking compute nodes to IO nodes and
 ###   IO nodes to positions in the torus interconnect
@@ -200,9 +1065,12 @@ def get_gordon_topology(topo_params):
 
         if (abs_node % compute_per_ion == 0):
             abs_ion = int(abs_node / compute_per_ion)
-            ion_x = int(abs_ion / torus_size[2]) % torus_size[0]
-            ion_y = int(abs_ion / torus_size[2] / torus_size[0] )
-            ion_z = abs_ion % torus_size[2]
+            ion_pos = [ 0 ] * len(torus_size)
+            position = abs_ion
+            for dim in _torus_order(torus_size):
+                ion_pos[dim] = position % torus_size[dim]
+                position //= torus_size[dim]
+            ion_pos = tuple(ion_pos)
             my_ion_rack = ion_racks[int(abs_ion/compute_per_ion)]
             my_ion_row = abs_ion % ion_per_rack + 1
             my_ion_string = "ion-%d-%d" % ( my_ion_rack, my_ion_row )
@@ -215,7 +1083,7 @@ def get_gordon_topology(topo_params):
         my_col = node_within_rack % 8  + 1
         my_slot = 10*my_row + my_col
         my_node_string = "gcn-%d-%d" % ( my_rack, my_slot )
-        node_torus_position[my_node_string] = ( ion_x, ion_y, ion_z )
+        node_torus_position[my_node_string] = ion_pos
 
         this_ions_computes.append(my_node_string)
         compute2ion[my_node_string] = my_ion_string
@@ -223,7 +1091,7 @@ def get_gordon_topology(topo_params):
         # finalize this ion and prepare for the next one
         if ((abs_node + 1) % compute_per_ion == 0):
             ion2compute[my_ion_string] = this_ions_computes
-            ion2torus[my_ion_string] = ( ion_x, ion_y, ion_z )
+            ion2torus[my_ion_string] = ion_pos
             this_ions_computes = []
 
     # return a dictionary containing all of the calculated data
@@ -233,6 +1101,446 @@ def get_gordon_topology(topo_params):
              'ion_list':     ion_list,
              'torus_size':   torus_size }
 
+### load_gordon_topology: the GordonTopology for topo_params, backed by an
+###   optional cache file that is rebuilt whenever topo_params no longer match
+###   its contents, and with hop distances that route around the links and
+###   IONs listed in an optional faults file
+def load_gordon_topology(topo_params, cache_file=None, faults_file=None):
+    topo = GordonTopology.load(topo_params, cache_file)
+    if faults_file:
+        topo.apply_faults(*read_faults(faults_file, topo))
+    return topo
+
+### load_topology: load_gordon_topology for Gordon's own layout, using the
+###   cache named by GORDON_TOPOLOGY_CACHE if set
+def load_topology(faults_file=None):
+    try:
+        return load_gordon_topology(get_topo_params(),
+            os.environ.get('GORDON_TOPOLOGY_CACHE'), faults_file)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+
+### read_faults: read a list of failed torus links and IONs.  Each line names
+###   either two IONs (a dead link between them) or a single ION that is down;
+###   lines may be prefixed with "link" or "ion".  The output of
+###   check-torus-health is also accepted, in which case every subrack with
+###   all of its nodes bad marks its ION down.  Returns ( failed_links,
+###   failed_ions ) as lists of ION names
+def read_faults(faults_file, topo):
+    health_rex = re.compile(r'^subrack\s+(gcn-\d+-\d)\*\s+has\s+(\d+)/\s*(\d+)')
+    # check-torus-health's summary and cleanup lines
+    health_other_rex = re.compile(r'(subracks are healthy|^removed )')
+    failed_links = []
+    failed_ions = []
+    with open(faults_file, 'r') as fp:
+        for line in fp:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            match = health_rex.match(line)
+            if match:
+                if int(match.group(2)) == int(match.group(3)) > 0:
+                    node = match.group(1) + '1'
+                    failed_ions.append(topo.ion_names[topo.ions(node)])
+                continue
+            elif health_other_rex.search(line):
+                continue
+            fields = line.split()
+            if fields[0] in ( 'link', 'ion' ):
+                fields = fields[1:]
+            for ion in fields:
+                if ion not in topo.ion_index:
+                    raise ValueError('%s: unknown ION %s' % ( faults_file, ion ))
+            if len(fields) == 2:
+                failed_links.append(tuple(fields))
+            elif len(fields) == 1:
+                failed_ions.append(fields[0])
+            elif fields:
+                raise ValueError('%s: cannot parse "%s"' % ( faults_file, line ))
+    return failed_links, failed_ions
+
+### Topology cache file layout.  All integers are little-endian:
+###   magic, md5 of topo_params, header (n_nodes, n_ions, n_dims, name bytes),
+###   uint16 torus size, uint16 node->ion ids, uint16 ion torus coordinates,
+###   uint16 ion x ion hop table, then newline-separated compute node names
+###   followed by ion names.  A compute node's integer id is its position in
+###   the name list.
+_CACHE_MAGIC = b'GTOPO\x00\x00\x01'
+_CACHE_HEADER = '<8s16s4I'
+
+def _topo_params_key(topo_params):
+    return hashlib.md5(repr(sorted(topo_params.items())).encode()).digest()
+
+class GordonTopology(topology.Topology):
+    """
+    Gordon's compute node -> IO node -> torus layout held as integer ids:
+    node_ion gives the IO node of every node and ion_coords the torus
+    coordinates of every IO node.  The IO nodes are the endpoints of the
+    topology.Topology interface.  Nodes may be given by name (gcn-XX-YY) or
+    by integer id, which is a node's position in node_names.  Queries on one
+    node or a pair are answered in plain Python; queries on many nodes use
+    NumPy indexing into integer arrays of node_ion and ion_coords, which are
+    built by the first such query and kept for the rest.  To use it from another program, load this file as a
+    module (imp.load_source on Python 2, or importlib's
+    spec_from_file_location on Python 3) and then
+
+        topo = gordon_topology.GordonTopology.load()
+        topo.hops(['gcn-2-11', 'gcn-2-12'], 'gcn-20-88')
+    """
+
+    __slots__ = ( 'node_names', 'node_index', 'ion_names', 'ion_index',
+                  'node_ion', 'ion_coords', 'ion_hops', 'torus_size',
+                  'failed_ions', 'arrays' )
+
+    def __init__(self, node_names, ion_names, node_ion, ion_coords, torus_size,
+                 ion_hops=None):
+        self.node_names = list(node_names)
+        self.node_index = dict(zip(self.node_names, range(len(self.node_names))))
+        self.ion_names = list(ion_names)
+        self.ion_index = dict(zip(self.ion_names, range(len(self.ion_names))))
+        self.node_ion = [ int(ion) for ion in node_ion ]
+        self.ion_coords = [ tuple([ int(x) for x in coord ])
+                            for coord in ion_coords ]
+        self.torus_size = tuple([ int(x) for x in torus_size ])
+        # None until a table is loaded or faults are applied: the hops are
+        # then torus distances, worked out from ion_coords as needed
+        self.ion_hops = ion_hops
+        self.failed_ions = []
+        self.arrays = None
+
+    @classmethod
+    def from_topo_data(cls, topo_data):
+        ion_list = topo_data['ion_list']
+        ion_index = dict(zip(ion_list, range(len(ion_list))))
+        node_names = []
+        for ion in ion_list:
+            node_names.extend(topo_data['ion2compute'][ion])
+        return cls( node_names, ion_list,
+                    [ ion_index[topo_data['compute2ion'][node]]
+                      for node in node_names ],
+                    [ topo_data['ion2torus'][ion] for ion in ion_list ],
+                    topo_data['torus_size'] )
+
+    @classmethod
+    def load(cls, topo_params=None, cache_file=None):
+        """
+        Build the topology from topo_params (Gordon's by default), reading it
+        from and saving it to cache_file if one is given
+        """
+        if topo_params is None:
+            topo_params = get_topo_params()
+        if not cache_file:
+            return cls.from_topo_data(get_gordon_topology(topo_params))
+
+        key = _topo_params_key(topo_params)
+        try:
+            topo = cls.read_cache(cache_file, key)
+        except (IOError, OSError, ValueError, struct.error):
+            topo = None
+        if topo is not None:
+            return topo
+
+        topo = cls.from_topo_data(get_gordon_topology(topo_params))
+        try:
+            topo.write_cache(cache_file, key)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Could not write topology cache %s: %s\n'
+                % ( cache_file, e ))
+        return topo
+
+    @classmethod
+    def read_cache(cls, cache_file, key):
+        """
+        Memory-map a cache file and unpack its id arrays and hop table.
+        Returns None if the file was built from other topo_params
+        """
+        with open(cache_file, 'rb') as fp:
+            buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, file_key, n_nodes, n_ions, n_dims, names_len = \
+                struct.unpack_from(_CACHE_HEADER, buf, 0)
+            if magic != _CACHE_MAGIC or file_key != key:
+                return None
+
+            arrays = []
+            offset = struct.calcsize(_CACHE_HEADER)
+            for count in ( n_dims, n_nodes, n_ions * n_dims, n_ions * n_ions ):
+                arrays.append(struct.unpack_from('<%dH' % count, buf, offset))
+                offset += 2 * count
+            torus_size, node_ion, ion_coords, ion_hops = arrays
+            names = buf[offset:offset+names_len].decode('ascii').split('\n')
+        finally:
+            buf.close()
+        if len(names) != n_nodes + n_ions:
+            raise ValueError('corrupt topology cache %s' % cache_file)
+
+        return cls( names[:n_nodes], names[n_nodes:], node_ion,
+                    [ ion_coords[i*n_dims:(i+1)*n_dims] for i in range(n_ions) ],
+                    torus_size,
+                    [ ion_hops[i*n_ions:(i+1)*n_ions] for i in range(n_ions) ] )
+
+    def write_cache(self, cache_file, key):
+        """
+        Save the topology in the compact cache format.  The file is written
+        under a temporary name and renamed into place so concurrent readers
+        never see a partial cache
+        """
+        names = '\n'.join(self.node_names + self.ion_names).encode('ascii')
+        header = struct.pack( _CACHE_HEADER, _CACHE_MAGIC, key,
+            len(self.node_names), len(self.ion_names), len(self.torus_size),
+            len(names) )
+        ions = range(len(self.ion_names))
+
+        import tempfile
+        fd, tmp_file = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(cache_file)) )
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(header)
+                for data in ( self.torus_size, self.node_ion,
+                              [ x for coord in self.ion_coords for x in coord ],
+                              [ hops for row in self.endpoint_table(ions)
+                                for hops in row ] ):
+                    fp.write(struct.pack('<%dH' % len(data), *data))
+                fp.write(names)
+            os.chmod(tmp_file, 0o644)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError):
+            os.unlink(tmp_file)
+            raise
+
+    def ion_links(self):
+        'Pairs of indices into ion_names for every torus link'
+        import numpy as np
+        ion_at = np.empty(len(self.ion_names), dtype=int)
+        ion_at[torus_index(self.ion_coords, self.torus_size)] = \
+            np.arange(len(self.ion_names))
+        end1, end2 = torus_links(self.torus_size)
+        return ion_at[end1], ion_at[end2]
+
+    def apply_faults(self, failed_links=(), failed_ions=()):
+        """
+        Replace the hop table with shortest-path distances over the torus
+        without the given links (pairs of ION names) and IONs.  Distances are
+        found by a breadth-first search from every ION at once, expanding all
+        frontiers with one matrix product per hop.  IONs that cannot reach
+        each other, and failed IONs, get a distance of -1
+        """
+        import numpy as np
+        n_ions = len(self.ion_names)
+        adjacency = np.zeros((n_ions, n_ions), dtype=bool)
+        end1, end2 = self.ion_links()
+        adjacency[end1, end2] = adjacency[end2, end1] = True
+        for ion1, ion2 in failed_links:
+            i, j = self.ion_index[ion1], self.ion_index[ion2]
+            adjacency[i, j] = adjacency[j, i] = False
+        up = np.ones(n_ions, dtype=bool)
+        up[[ self.ion_index[ion] for ion in failed_ions ]] = False
+        adjacency &= up[:, np.newaxis] & up[np.newaxis]
+
+        ion_hops = np.full((n_ions, n_ions), -1, dtype=int)
+        reached = np.diag(up)
+        frontier = reached.copy()
+        ion_hops[reached] = 0
+        hops = 0
+        while frontier.any():
+            hops += 1
+            frontier = np.dot(frontier, adjacency) & ~reached
+            ion_hops[frontier] = hops
+            reached |= frontier
+
+        self.ion_hops = ion_hops
+        self.failed_ions = [ ion for ion in self.ion_names
+                             if not up[self.ion_index[ion]] ]
+
+    @property
+    def endpoint_names(self):
+        return self.ion_names
+
+    @property
+    def node_endpoint(self):
+        return self.node_ion
+
+    def array(self, name):
+        """
+        node_ion or ion_coords (one row per IO node) as a NumPy integer array,
+        converted on the first call and reused by the batched queries after it
+        """
+        if self.arrays is None:
+            import numpy as np
+            self.arrays = {
+                'node_ion':     np.array(self.node_ion, dtype=int),
+                'ion_coords':   np.array(self.ion_coords, dtype=int).reshape(
+                                    len(self.ion_coords), len(self.torus_size)) }
+        return self.arrays[name]
+
+    def endpoint_hops(self):
+        import numpy as np
+        if self.ion_hops is None:
+            coords = self.array('ion_coords')
+            self.ion_hops = torus_hops( coords[:, np.newaxis],
+                                        coords[np.newaxis], self.torus_size )
+        self.ion_hops = np.asarray(self.ion_hops, dtype=int)
+        return self.ion_hops
+
+    def endpoint_hop(self, ion1, ion2):
+        if self.ion_hops is None:
+            return get_hops( self.ion_coords[ion1], self.ion_coords[ion2],
+                             self.torus_size )
+        return int(self.ion_hops[ion1][ion2])
+
+    def endpoint_table(self, ions):
+        return [ [ self.endpoint_hop(ion1, ion2) for ion2 in ions ]
+                 for ion1 in ions ]
+
+    def endpoint_links(self):
+        return self.ion_links()
+
+    def endpoint_label(self, endpoint):
+        return '%s at (%s)' % ( self.ion_names[endpoint],
+            ', '.join([ str(x) for x in self.ion_coords[endpoint] ]) )
+
+    def histogram(self, nodes):
+        """
+        topology.Topology.histogram, summed in plain Python unless NumPy is
+        already loaded: for a few nodes that takes less time than loading it
+        """
+        if 'numpy' in sys.modules:
+            return topology.Topology.histogram(self, nodes)
+        counts = {}
+        for node in nodes:
+            if isinstance(node, str):
+                node = self.node_index[node]
+            ion = self.node_ion[node]
+            counts[ion] = counts.get(ion, 0) + 1
+        used = sorted(counts)
+        hop_table = self.endpoint_table(used)
+        histogram = [ 0 ] if used else []
+        for i, ion1 in enumerate(used):
+            for j in range(i, len(used)):
+                if i == j:
+                    pairs = counts[ion1] * (counts[ion1] - 1) // 2
+                else:
+                    pairs = counts[ion1] * counts[used[j]]
+                if not pairs:
+                    continue
+                hops = hop_table[i][j]
+                if hops < 0:
+                    raise ValueError('No path between %s and %s'
+                        % ( self.ion_names[ion1], self.ion_names[used[j]] ))
+                if hops >= len(histogram):
+                    histogram.extend([ 0 ] * (hops + 1 - len(histogram)))
+                histogram[hops] += pairs
+        return histogram
+
+    def endpoints(self, nodes):
+        if isinstance(nodes, str):
+            return self.node_ion[self.node_index[nodes]]
+        return self.array('node_ion')[self.node_ids(nodes)]
+
+    def ions(self, nodes):
+        'Index into ion_names of the IO node serving each node'
+        return self.endpoints(nodes)
+
+    def check_nodes(self, nodes):
+        """
+        Raises ValueError for the first of a list of node names that is
+        behind a failed IO node, and KeyError for an unknown name
+        """
+        failed = set(self.failed_ions)
+        for node in nodes:
+            ion = self.ion_names[self.node_ion[self.node_index[node]]]
+            if ion in failed:
+                raise ValueError('Node %s is behind failed ION %s'
+                    % ( node, ion ))
+
+    def coords(self, nodes):
+        'Torus coordinates of each node, in a trailing axis'
+        return self.array('ion_coords')[self.ions(nodes)]
+
+### torus_coords: convert linear torus positions into coordinates.  The last
+###   dimension varies fastest, then the first, then the rest in order; for
+###   Gordon's 4x4x4 torus this is z, then x, then y
+def torus_coords(index, torus_size):
+    import numpy as np
+    index = np.asarray(index)
+    coords = np.empty(index.shape + (len(torus_size),), dtype=int)
+    for dim in _torus_order(torus_size):
+        coords[..., dim] = index % torus_size[dim]
+        index = index // torus_size[dim]
+    return coords
+
+### torus_index: inverse of torus_coords
+def torus_index(coords, torus_size):
+    import numpy as np
+    coords = np.asarray(coords)
+    index = np.zeros(coords.shape[:-1], dtype=int)
+    for dim in reversed(_torus_order(torus_size)):
+        index = index * torus_size[dim] + coords[..., dim]
+    return index
+
+def _torus_order(torus_size):
+    n_dims = len(torus_size)
+    return [ n_dims - 1 ] + list(range(n_dims - 1))
+
+### torus_links: enumerate every link of a torus directly from coordinates as
+###   two arrays of linear positions.  Each position links to its +1 neighbor
+###   in every dimension; a dimension of size two has only one link per pair
+###   of positions and a dimension of size one has none
+def torus_links(torus_size):
+    import numpy as np
+    positions = np.arange(int(np.prod(torus_size)))
+    coords = torus_coords(positions, torus_size)
+    end1, end2 = [], []
+    for dim, size in enumerate(torus_size):
+        if size < 2:
+            continue
+        source = positions if size > 2 else positions[coords[:, dim] == 0]
+        neighbor = coords[source].copy()
+        neighbor[:, dim] = (neighbor[:, dim] + 1) % size
+        end1.append(source)
+        end2.append(torus_index(neighbor, torus_size))
+    if not end1:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    return np.concatenate(end1), np.concatenate(end2)
+
+### torus_hops: vectorized get_hops.  coords1 and coords2 are arrays whose last
+###   axis holds torus coordinates; they are broadcast against each other
+def torus_hops(coords1, coords2, torus_size):
+    import numpy as np
+    size = np.asarray(torus_size)
+    delta = np.abs(np.asarray(coords1) - np.asarray(coords2))
+    return np.minimum(delta, size - delta).sum(axis=-1)
+
+### torus_routes: route flows from coords1 to coords2 with dimension-ordered
+###   routing, taking the shorter way around each ring (the + direction on a
+###   tie).  Returns ( flow, link ) arrays with one entry per hop, where flow
+###   indexes the input rows and link is the directed link taken, numbered
+###   position * 2 * n_dims + dim * 2 + (0 for +, 1 for -)
+def torus_routes(coords1, coords2, torus_size):
+    import numpy as np
+    current = np.array(coords1, dtype=int, ndmin=2)
+    target = np.array(coords2, dtype=int, ndmin=2)
+    flow_ids = np.arange(len(current))
+    n_dims = len(torus_size)
+    flows, links = [], []
+    for dim, size in enumerate(torus_size):
+        forward = (target[:, dim] - current[:, dim]) % size
+        backward = (size - forward) % size
+        reverse = backward < forward
+        steps = np.where(reverse, backward, forward)
+        step = np.where(reverse, -1, 1)
+        for hop in range(int(steps.max()) if len(steps) else 0):
+            moving = steps > hop
+            position = torus_index(current[moving], torus_size)
+            flows.append(flow_ids[moving])
+            links.append(position * 2 * n_dims + dim * 2 + reverse[moving])
+            current[moving, dim] = (current[moving, dim] + step[moving]) % size
+    if not flows:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    return np.concatenate(flows), np.concatenate(links)
+
 ### get_hops:  calculate hop distance between two tuples containing torus 
 ###   coordinates of arbitrary dimensionality
 def get_hops(node1, node2, torus_size):
@@ -246,7 +1554,7 @@ def get_hops(node1, node2, torus_size):
     return hops
 
 def print_help(argv):
-        print r"""  Syntax:
+        print(r"""  Syntax:
     %20s                         Prints rack layout for system
     %20s gcn-XX-YY gcn-AA-BB ... Prints stats on hop distances 
                                                  between all pairs in given list
@@ -259,7 +1567,65 @@ def print_help(argv):
         | grep -o '<exec_host>.*</exec_host>' \
         | grep -Eo 'gcn-[^-]*-[^/]*' \
         | uniq)
-""" % ( argv[0], argv[0], argv[0] )
+
+    %20s --batch [--json] [file ...]
+                                 Prints hop statistics for every job in a
+                                 qstat -x dump (or in lines of "jobid
+                                 exec_host") read from files or stdin, e.g.
+
+    qstat -x | %s --batch > hops.csv
+
+    %20s --graph [XxYxZ...]
+                                 Prints the torus and IO node connectivity in
+                                 the dot format, or only the links of a bare
+                                 torus of the given dimensions
+
+    %20s --congestion [options] [gcn-XX-YY ...]
+                                 Routes a traffic pattern between the ranks
+                                 of a job over the torus and reports per-link
+                                 load and the hottest links; see
+                                 --congestion --help
+
+    %20s --comm-cost --matrix FILE [options] [gcn-XX-YY ...]
+                                 Weights the hops between the ranks of a job
+                                 by the bytes each pair exchanges in FILE
+                                 ("src_rank dst_rank bytes" lines) and lists
+                                 the busiest IONs and worst-placed rank
+                                 pairs; see --comm-cost --help
+
+    %20s --interference [options] [file ...]
+                                 Routes every job in a qstat -x dump (or in
+                                 lines of "jobid exec_host") over the torus
+                                 at once and reports the links and IONs that
+                                 jobs share; see --interference --help
+
+    %20s --reorder [options] [gcn-XX-YY ...]
+                                 Prints a hostfile (or with --rankfile, an
+                                 Open MPI rankfile) that orders the ranks of
+                                 a --grid, --ring or --matrix communication
+                                 pattern over the given nodes so partners sit
+                                 few hops apart; see --reorder --help
+
+    %20s --select N [--mean] [gcn-XX-YY ...]
+                                 Picks N nodes out of the given free nodes
+                                 (or the first column of stdin, e.g. from
+                                 pbsnodes -l free) that minimize the maximum
+                                 (or with --mean, the mean) hop distance
+
+   Add --faults FILE to any of the above to route around the failed links and
+   IONs listed in FILE (pairs of ION names for links, single ION names for
+   IONs, or the output of check-torus-health).
+
+   Add --profile FILE to append the time and calls of each phase of the run
+   to FILE as JSON lines, --profile-memory to also record each phase's peak
+   memory (which slows the run down), and --cprofile FILE to also dump
+   cProfile statistics.
+
+   Set GORDON_TOPOLOGY_CACHE to a file path to keep a compact, memory-mapped
+   copy of the topology there; it is rebuilt automatically if the layout
+   parameters change.
+""" % ( argv[0], argv[0], argv[0], argv[0], argv[0], argv[0], argv[0],
+        argv[0], argv[0], argv[0], argv[0] ))
 
 if __name__ == "__main__":
     main(sys.argv)
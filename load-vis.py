@@ -2,19 +2,27 @@
 ################################################################################
 ###  load-vis.py: use matplotlib to assign some value to each node and
 ###    create a graphic likening those values to the physical layout of 
-###    those nodes within the cluster.
+###    those nodes within the cluster.  matplotlib is only imported when it is
+###    used; --backend direct writes SVG or PNG without it.
 ###
 ###  Glenn K. Lockwood, San Diego Supercomputer Center          February 2014
 ################################################################################
 
 import fileinput
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import re
 import platform
 import sys
+import os
+import io
+import shutil
+import tarfile
+import tempfile
+import argparse
+import subprocess
+import xml.etree.ElementTree as ElementTree
+import phase_profile
+import torque_xml
 
 class Rack:
     'Contains information for an entire rack'
@@ -29,18 +37,22 @@ class Rack:
         self.cpugrid[:] = config['ppn']
 
 ################################################################################
-### draw_rack: wrapper function that calls the machine-specific draw function
-    def draw(self, ax, config):
+### layout: wrapper function that calls the machine-specific layout function.
+###   Returns a dict of flat arrays describing every node to be drawn (x, y,
+###   width, height, load, cpus, on_top for nodes drawn over the others, and
+###   slot, the node's flat index into the rack's grids) and the ( x, y, text )
+###   of the rack's label
+    def layout(self, config):
         if config['system'] == 'gordon':
-            self.draw_gordon( ax, config )
+            return self.layout_gordon( config )
         elif config['system'] == 'trestles':
-            self.draw_trestles( ax, config )
+            return self.layout_trestles( config )
 
 ################################################################################
-### draw_rack_gordon: subroutine to draw Gordon's racks.  Note that the 
-###   meaning of x/y are currently screwed up in the code, but the end result is
-### right.  I need to fix this someday.
-    def draw_gordon(self, ax, config):
+### layout_gordon: lay out Gordon's racks.  Note that the meaning of x/y are
+###   currently screwed up in the code, but the end result is right.  I need to
+###   fix this someday.
+    def layout_gordon(self, config):
         ppn = config['ppn']
 
         # how wide/tall do our nodes appear in the plot?
@@ -61,51 +73,26 @@ class Rack:
         node_x = float(rack_x * ((2+config['rack_xdim'])*size_x))
         node_y = float(rack_y * ((2+config['rack_ydim'])*size_y))
 
-        # add text label for this rack
-        plt.text(node_x, node_y-0.1, "rack%d" % rack)
-
-        supernodes = list()
-
-        for (y,x),w in np.ndenumerate(self.loadgrid):
-
-            if w < -1.5:
-                color = 'grey'
-            elif w < -0.5:
-                color = 'red'
-            elif w > (1.1 * float(ppn)):
-                color = 'yellow'
-            else:
-                color = cm((0.50 + w/float(self.cpugrid[y,x]))/1.25)
-
-            # coordinates on the actual plot
-            plot_x = x*size_x + node_x
-            plot_y = y*size_y + node_y
-
-            # if this is the last node in a vsmp supernode, draw the supernode
-            if self.cpugrid[y, x] > ppn:
-                my_size_x = size_x * config['rack_xdim']
-                my_size_y = size_y * config['subrack_ydim']
-            else:
-                my_size_x = size_x
-                my_size_y = size_y
-        
-            rect = plt.Rectangle([plot_x, plot_y], 
-                my_size_x, 
-                my_size_y,
-                facecolor=color,
-                edgecolor='black')
-
-            if self.cpugrid[y, x] > ppn:
-                supernodes.append(rect)
-            else:
-                ax.add_patch(rect)
-
-        # draw supernodes last so they are on top of the compute nodes
-        for rect in supernodes:
-            ax.add_patch(rect)
-
-    def draw_trestles( self, ax, config ):
-        ppn = config['ppn']
+        y, x = np.indices(self.loadgrid.shape)
+
+        # the last node in a vsmp supernode is drawn as the whole supernode
+        supernode = self.cpugrid > ppn
+
+        nodes = {
+            'x':        (x*size_x + node_x).ravel(),
+            'y':        (y*size_y + node_y).ravel(),
+            'width':    np.where(supernode, size_x * config['rack_xdim'],
+                                 size_x).ravel(),
+            'height':   np.where(supernode, size_y * config['subrack_ydim'],
+                                 size_y).ravel(),
+            'load':     self.loadgrid.ravel(),
+            'cpus':     self.cpugrid.ravel(),
+            'on_top':   supernode.ravel(),
+            'slot':     np.arange(self.loadgrid.size),
+        }
+        return nodes, (node_x, node_y-0.1, "rack%d" % rack)
+
+    def layout_trestles( self, config ):
         rack = self.rackid
 
         # how wide/tall do our nodes appear in the plot?
@@ -125,48 +112,111 @@ class Rack:
         node_x = float(rack_x * (config['rack_xdim']*size_x + 2.0) )
         node_y = float(rack_y * (config['rack_ydim']*size_y + 2.0))
 
-        # add text label for this rack
-        plt.text(node_x, node_y+0.5, "rack %d" % rack)
+        x, y = np.indices(self.loadgrid.shape)
+
+        # special hacks for trestles-some racks are just not populated
+        populated = y >= 2
+        if rack == 12:
+            populated &= y <= 25
+
+        # coordinates on the actual plot.  Trestles is racked upside-down so
+        # that the lowest node slots are at the bottom of the rack
+        nodes = {
+            'x':        x*size_x + node_x,
+            'y':        (config['rack_ydim']-y)*size_y + node_y,
+            'width':    np.full(x.shape, size_x),
+            'height':   np.full(x.shape, size_y),
+            'load':     self.loadgrid,
+            'cpus':     self.cpugrid,
+            'on_top':   np.zeros(x.shape, dtype=bool),
+            'slot':     np.arange(x.size).reshape(x.shape),
+        }
+        for key in nodes:
+            nodes[key] = nodes[key][populated]
+        return nodes, (node_x, node_y+0.5, "rack %d" % rack)
 
-        supernodes = list()
+################################################################################
+### layout_racks: lay out every rack at once.  Returns the concatenated node
+###   arrays from Rack.layout, ordered so that each rack's on_top nodes follow
+###   its other nodes, and a list of rack labels.  The added rack array gives
+###   each node's position in the racks' iteration order
+def layout_racks( racks, config ):
+    layouts = [ racks[rack].layout( config ) for rack in racks ]
+    labels = [ label for nodes, label in layouts ]
+    empty = Rack( config, 1 ).layout( config )[0]
+    nodes = {}
+    for key in empty:
+        nodes[key] = np.concatenate([ empty[key][:0] ] +
+                                    [ n[key] for n, label in layouts ])
+    nodes['rack'] = np.repeat(np.arange(len(layouts)),
+        [ len(n['x']) for n, label in layouts ])
+
+    # draw supernodes last within their rack so they are on top of its
+    # compute nodes
+    order = np.lexsort(( nodes['on_top'], nodes['rack'] ))
+    for key in nodes:
+        nodes[key] = nodes[key][order]
+    return nodes, labels
 
-        for (x,y),w in np.ndenumerate(self.loadgrid):
+################################################################################
+### node_colors: turn node loads into an array of RGBA colors.  Unknown nodes
+###   are grey, offline/down nodes red, overloaded nodes yellow, and the rest
+###   are shaded by cmap according to load per cpu
+def node_colors( load, cpus, ppn, cmap ):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        colors = np.array(cmap((0.50 + load/cpus)/1.25), dtype=float)
+    colors[load > (1.1 * float(ppn))] = ( 1.0, 1.0, 0.0, 1.0 )  # yellow
+    colors[load < -0.5] = ( 1.0, 0.0, 0.0, 1.0 )                # red
+    colors[load < -1.5] = ( 0.5, 0.5, 0.5, 1.0 )                # grey
+    return colors
 
-            # special hacks for trestles-some racks are just not populated
-            if y < 2:
-                continue
-            if rack == 12 and y > 25:
-                continue
+################################################################################
+### outage_colors: like node_colors, but shade each node by cmap according to
+###   the fraction of time it was out of service, stored as its load, relative
+###   to the node that was out the most
+def outage_colors( load, cpus, ppn, cmap ):
+    worst = load.max() if len(load) else 0.0
+    colors = np.array(cmap(load / worst if worst > 0.0 else load), dtype=float)
+    colors[load < -1.5] = ( 0.5, 0.5, 0.5, 1.0 )                # grey
+    return colors
 
-            if w < -1.5:
-                color = 'grey'
-            elif w < -0.5:
-                color = 'red'
-            elif w > (1.1 * float(ppn)):
-                color = 'yellow'
-            else:
-                color = cm((0.50 + w/float(self.cpugrid[x,y]))/1.25)
+################################################################################
+### node_vertices: corners of every node's rectangle, shaped ( nodes, 4, 2 )
+def node_vertices( nodes ):
+    x0 = nodes['x']
+    y0 = nodes['y']
+    x1 = x0 + nodes['width']
+    y1 = y0 + nodes['height']
+    return np.stack([ np.stack([ x0, y0 ], axis=-1),
+                      np.stack([ x1, y0 ], axis=-1),
+                      np.stack([ x1, y1 ], axis=-1),
+                      np.stack([ x0, y1 ], axis=-1) ], axis=1)
 
-            # coordinates on the actual plot.  Trestles is racked upside-down so
-            # that the lowest node slots are at the bottom of the rack
-            plot_x = x*size_x + node_x
-            plot_y = (config['rack_ydim']-y)*size_y + node_y
+################################################################################
+### draw_racks: draw every node of every rack as a single collection, colored
+###   by colors (node_colors or outage_colors).  Returns the collection so that
+###   its colors can be updated later
+def draw_racks( ax, racks, config, cmap, colors=node_colors ):
+    from matplotlib.collections import PolyCollection
+    nodes, labels = layout_racks( racks, config )
 
-            my_size_x = size_x
-            my_size_y = size_y
-        
-            rect = plt.Rectangle([plot_x, plot_y], 
-                my_size_x, 
-                my_size_y,
-                facecolor=color,
-                edgecolor='black')
+    collection = PolyCollection( node_vertices( nodes ),
+        facecolors=colors( nodes['load'], nodes['cpus'], config['ppn'], cmap ),
+        edgecolors='black', joinstyle='miter' )
+    ax.add_collection( collection )
 
-            ax.add_patch(rect)
+    # add text label for each rack
+    for x, y, text in labels:
+        ax.text(x, y, text)
+
+    return collection
 
 ################################################################################
-### get_sys_config: define system and diagram geometry here
-def get_sys_config():
-    hostname=platform.node()
+### get_sys_config: define system and diagram geometry here, for the system
+###   named by hostname (default: this host)
+def get_sys_config( hostname=None ):
+    if hostname is None:
+        hostname=platform.node()
     if hostname.find("gordon") != -1 or hostname.find("gcn") != -1:
         config = {  'rack_xdim':    8,         # nodes per rack in x direction
                     'rack_ydim':    8,         # nodes per rack in y direction
@@ -192,137 +242,700 @@ def get_sys_config():
 
 
 ################################################################################
-### ingest_and_plot_load: read the output of `nodeview --nocolor`, turn
-###   into load values, populate racks, and draw them
-def ingest_and_plot_load( ax ):
+### node_positions: turn arrays of node name prefixes, rack and slot numbers
+###   into the rack number and ( x, y ) position within that rack's grids
+def node_positions( prefix, rack, slot, config ):
+    # special hack just for the sandy bridge vSMP node
+    vsmp = (prefix == 'ion') & (rack == 21) & (slot == 1)
+    rack = np.where(vsmp, 17, rack)
+    slot = np.where(vsmp, 11, slot)
+
+    # Gordon's node numbering is encoded in tens and ones digits, not 
+    # ordered sequentially
+    if config['system'] == "gordon":
+        x = slot // 10 - 1          # row
+        y = slot % 10 - 1           # column
+    else:
+        x = np.zeros_like(slot)     # row
+        y = slot - 1                # column
+    return rack, x, y
 
-    linerex = re.compile(r"""
-        ^(\S+)-(\d+)-(\d+)\s+
-        \d+\s+
-        \d+\s+
-        (\d+)\s+
-        \d+/\d+\s+
-        \S+\s+
-        \S+\s+
-        (\d+\.\d+)\s*
-        (\S+)\s*$""", re.VERBOSE)
-    staterex = re.compile("(offline|down)")
+################################################################################
+### fill_racks: populate racks from flat arrays describing every node (its
+###   name prefix, rack and slot numbers, cpus and load) and return them, keyed
+###   by rack number as a string in order of first appearance
+def fill_racks( prefix, rack, slot, cpus, load, config ):
+    rack, x, y = node_positions( prefix, rack, slot, config )
 
     racks = {}
-
-    for line in fileinput.input():
-        match = linerex.match(line)
-        if not match:
-            continue
-        nodename = match.group(1)
-        rack_id = match.group(2)
-        rack = int(rack_id)
-        slot = int(match.group(3))
-        cpus = int(match.group(4))
-        load = float(match.group(5))
-
-        # special hack just for the sandy bridge vSMP node
-        if nodename == 'ion' and rack == 21 and slot == 1:
-            nodename = 'gcn'
-            rack = 17
-            rack_id = str(rack)
-            slot = 11
-
-        # offline or downed nodes get tagged with -1
-        if staterex.match(match.group(6)):
-            load = -1.00
-
-        # Gordon's node numbering is encoded in tens and ones digits, not 
-        # ordered sequentially
-        if config['system'] == "gordon":
-            x = int(slot/10) - 1    # row
-            y = slot % 10 - 1       # column
-        else:
-            x = 0                   # row
-            y = slot - 1            # column
-
-        # create a new rack if it's the first time this one has appeared
-        if rack_id not in racks:
-            racks[rack_id] = Rack( config, rack )
-
-        # finally assign some values
-        racks[rack_id].loadgrid[x, y] = load
-        racks[rack_id].cpugrid[x, y] = cpus
-
-    for rack in racks:
-        racks[rack].draw( ax, config )
+    rack_numbers, first = np.unique(rack, return_index=True)
+    for rack_number in rack_numbers[np.argsort(first)]:
+        this_rack = Rack( config, int(rack_number) )
+        in_rack = rack == rack_number
+        this_rack.loadgrid[x[in_rack], y[in_rack]] = load[in_rack]
+        this_rack.cpugrid[x[in_rack], y[in_rack]] = cpus[in_rack]
+        racks[str(rack_number)] = this_rack
+    return racks
 
 ################################################################################
-### ingest_and_plot_outage: read the output of `tally-outage.pl`,
-###   populate racks, and draw them
-def ingest_and_plot_outage( ax ):
+### read_nodeview: read the output of `nodeview --nocolor`, turn it into load
+###   values, and return the populated racks.  The whole text is matched with
+###   one regex and the fields converted as arrays
+def read_nodeview( text, config ):
 
-    linerex = re.compile(r"""^(\S+)-(\d+)-(\d+)\s+(\S+)\s*$""")
+    linerex = re.compile(r"""
+        ^(\S+)-(\d+)-(\d+)[ \t]+
+        \d+[ \t]+
+        \d+[ \t]+
+        (\d+)[ \t]+
+        \d+/\d+[ \t]+
+        \S+[ \t]+
+        \S+[ \t]+
+        (\d+\.\d+)[ \t]*
+        (\S+)[ \t]*$""", re.VERBOSE | re.MULTILINE)
+
+    fields = np.array(linerex.findall(text), dtype=str).reshape(-1, 6)
+    load = fields[:, 4].astype(float)
+
+    # offline or downed nodes get tagged with -1
+    state = fields[:, 5]
+    load[np.char.startswith(state, 'offline') |
+         np.char.startswith(state, 'down')] = -1.00
+
+    return fill_racks( fields[:, 0], fields[:, 1].astype(int),
+        fields[:, 2].astype(int), fields[:, 3].astype(int), load, config )
 
-    cpugrid[:] = config['ppn']
-    loadgrid[:] = -2.0      # -2 means node doesn't exist in queue
-    this_rack = -1
-    last_rack_printed = -1;
+################################################################################
+### read_pbsnodes: read `pbsnodes -x` XML from a binary file object, taking
+###   each node's load from the loadave in its status, and return the populated
+###   racks.  The XML is parsed incrementally and each node discarded once read
+def read_pbsnodes( fp, config ):
+    records = []
+    for event, elem in torque_xml.iterparse(fp):
+        if elem.tag == 'Node':
+            records.append('%s %s %s %s' % ( elem.findtext('name', ''),
+                elem.findtext('np', '') or '0',
+                elem.findtext('state', '') or '-',
+                elem.findtext('status', '') ))
+            elem.clear()
+
+    noderex = re.compile(r"""
+        ^(\S+)-(\d+)-(\d+)[ ]
+        (\d+)[ ]
+        (\S+)[ ]
+        (?:.*?(?:^|,|[ ])loadave=(\d+(?:\.\d+)?))?.*$""",
+        re.VERBOSE | re.MULTILINE)
+
+    fields = np.array(noderex.findall('\n'.join(records)),
+                      dtype=str).reshape(-1, 6)
+
+    # nodes that report no load are unknown; offline or downed nodes get
+    # tagged with -1
+    load = np.full(len(fields), -2.0)
+    reported = fields[:, 5] != ''
+    load[reported] = fields[reported, 5].astype(float)
+    state = fields[:, 4]
+    load[(np.char.find(state, 'offline') >= 0) |
+         (np.char.find(state, 'down') >= 0)] = -1.00
+
+    return fill_racks( fields[:, 0], fields[:, 1].astype(int),
+        fields[:, 2].astype(int), fields[:, 3].astype(int), load, config )
 
-    for line in fileinput.input():
-        match = linerex.match(line)
-        if not match:
-            continue
-        nodename = match.group(1)
-        rack = int(match.group(2))
-        slot = int(match.group(3))
-        load = float(match.group(4))
-
-        if rack != this_rack:
-            if this_rack >= 0:
-                draw_rack( loadgrid, cpugrid, this_rack, ax, config )
-                last_rack_printed = this_rack
-
-            loadgrid[:] = -2.0      # initialize a new rack of unknown nodes
-            cpugrid[:] = config['ppn']
-            this_rack = rack
-
-        if staterex.match(match.group(6)):
-            load = -1.00
-
-        # Gordon's node numbering is encoded in tens and ones digits, not 
-        # ordered sequentially
-        if config['system'] == "gordon":
-            x = int(slot/10) - 1    # row
-            y = slot % 10 - 1       # column
-        else:
-            x = 0                   # row
-            y = slot - 1            # column
+################################################################################
+### read_load: read either `pbsnodes -x` XML or nodeview output, whichever
+###   text contains, and return the populated racks
+def read_load( text, config ):
+    if text.lstrip().startswith('<'):
+        return read_pbsnodes( io.BytesIO(text.encode('utf-8')), config )
+    return read_nodeview( text, config )
 
-        loadgrid[x, y] = load
-        cpugrid[x, y] = cpus
+################################################################################
+### ingest_load: read nodeview output or pbsnodes XML from files (or stdin), or
+###   run pbsnodes directly, and return the populated racks
+def ingest_load( files=None, pbsnodes=None ):
+    if pbsnodes:
+        proc = subprocess.Popen([ pbsnodes, '-x' ], stdout=subprocess.PIPE)
+        racks = read_pbsnodes( proc.stdout, config )
+        if proc.wait():
+            raise OSError('%s -x exited with status %d'
+                % ( pbsnodes, proc.returncode ))
+        return racks
+    return read_load( ''.join(fileinput.input(files)), config )
 
-    # don't forget about the final rack
-    if last_rack_printed != this_rack and this_rack >= 0 and nodename != "ion":
-        draw_rack( loadgrid, cpugrid, this_rack, ax, config )
+################################################################################
+### ingest_and_plot_load: populate racks as ingest_load does and draw them
+def ingest_and_plot_load( ax, files=None, pbsnodes=None ):
+    draw_racks( ax, ingest_load( files, pbsnodes ), config, cm )
 
 ################################################################################
-### main function
-if __name__ == '__main__':
+### iter_snapshots: yield ( name, text ) for every snapshot (nodeview output or
+###   pbsnodes XML) in a directory or tarball, in order of name
+def iter_snapshots( source ):
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path):
+                with open(path, 'r') as fp:
+                    yield name, fp.read()
+    else:
+        tar = tarfile.open(source, 'r:*')
+        try:
+            members = sorted([ m for m in tar.getmembers() if m.isfile() ],
+                             key=lambda m: m.name)
+            for member in members:
+                text = tar.extractfile(member).read().decode('utf-8', 'replace')
+                yield os.path.basename(member.name), text
+        finally:
+            tar.close()
 
-    config = get_sys_config()
+################################################################################
+### parse_snapshot: pool worker that turns one snapshot into its rack grids
+def parse_snapshot( snapshot ):
+    name, text = snapshot
+    racks = read_load( text, config )
+    return name, dict([ ( rack_id, ( racks[rack_id].loadgrid,
+                                     racks[rack_id].cpugrid ) )
+                        for rack_id in racks ])
 
-    ### initialize the plot
-    ax = plt.gca()
+################################################################################
+### new_axes: create a figure with axes set up for drawing racks
+def new_axes():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    ax = fig.gca()
     ax.patch.set_facecolor((1,1,1,0.0))
     ax.axis('off')
     
     ax.set_aspect('equal', 'box')
     ax.xaxis.set_major_locator(plt.NullLocator())
     ax.yaxis.set_major_locator(plt.NullLocator())
-    cm = plt.get_cmap('Blues')
+    return fig, ax
+
+################################################################################
+### init_frame_renderer/render_frame: each pool worker draws the rack layout
+###   once, then renders every frame it is given by only recoloring the nodes
+_frame_renderer = {}
+
+def init_frame_renderer( vertices, labels ):
+    from matplotlib.collections import PolyCollection
+    fig, ax = new_axes()
+    collection = PolyCollection( vertices, edgecolors='black',
+        joinstyle='miter' )
+    ax.add_collection( collection )
+    for x, y, text in labels:
+        ax.text(x, y, text)
+    ax.autoscale_view()
+    ax.invert_yaxis()
+    _frame_renderer.update(fig=fig, ax=ax, collection=collection)
+
+def render_frame( frame ):
+    name, colors, path = frame
+    _frame_renderer['collection'].set_facecolors(colors)
+    _frame_renderer['ax'].set_title(name)
+    _frame_renderer['fig'].savefig(path, bbox_inches='tight')
+    return path
+
+################################################################################
+### replay_snapshots: render every snapshot (nodeview output or pbsnodes XML)
+###   in source (a directory or tarball) as one frame, and write the frames to
+###   output: a directory of PNGs, an animated .gif (needs Pillow) or an .mp4
+###   (needs ffmpeg).  Both parsing and rendering are spread over a pool of
+###   jobs processes
+def replay_snapshots( source, output, jobs=None, fps=10 ):
+    fmt = os.path.splitext(output)[1].lower()
+    scratch_dir = None      # where .gif and .mp4 frames are rendered
+    pool = phase_profile.Pool(jobs)
+    try:
+        frames = list(pool.imap( parse_snapshot, iter_snapshots( source ),
+                                 chunksize=8 ))
+        if not [ grids for name, grids in frames if grids ]:
+            raise ValueError('no nodeview snapshots found in %s' % source)
+
+        # every rack that appears in any snapshot is laid out once; a node's
+        # grid cpus come from the last snapshot that lists its rack
+        racks = {}
+        for name, grids in frames:
+            for rack_id in grids:
+                if rack_id not in racks:
+                    racks[rack_id] = Rack( config, int(rack_id) )
+                racks[rack_id].cpugrid = grids[rack_id][1]
+        nodes, labels = layout_racks( racks, config )
+        rack_ids = list(racks)
+        pool.close()
+        pool.join()
+
+        if fmt in ( '.gif', '.mp4' ):
+            scratch_dir = frame_dir = tempfile.mkdtemp(prefix='load-vis-')
+        else:
+            frame_dir = output
+            if not os.path.isdir(frame_dir):
+                os.makedirs(frame_dir)
+
+        pool = phase_profile.Pool(jobs, init_frame_renderer,
+            ( node_vertices( nodes ), labels ))
+        def iter_frames():
+            grid_shape = ( len(rack_ids), config['rack_xdim'] * config['rack_ydim'] )
+            for i, ( name, grids ) in enumerate(frames):
+                load = np.full(grid_shape, -2.0)
+                cpus = np.full(grid_shape, float(config['ppn']))
+                for j, rack_id in enumerate(rack_ids):
+                    if rack_id in grids:
+                        load[j] = grids[rack_id][0].ravel()
+                        cpus[j] = grids[rack_id][1].ravel()
+                colors = node_colors( load[nodes['rack'], nodes['slot']],
+                    cpus[nodes['rack'], nodes['slot']], config['ppn'], cm )
+                yield name, colors, os.path.join(frame_dir, 'frame-%05d.png' % i)
+        paths = list(pool.imap( render_frame, iter_frames(), chunksize=4 ))
+        pool.close()
+        pool.join()
+
+        if fmt == '.gif':
+            from PIL import Image
+            # open and copy the frames one at a time as Pillow asks for them:
+            # a day of one-minute snapshots is more frames than the usual
+            # limit of 1024 open files, and about a gigabyte decoded at once
+            def iter_images():
+                for path in paths[1:]:
+                    with Image.open(path) as image:
+                        yield image.copy()
+            with Image.open(paths[0]) as image:
+                first = image.copy()
+            first.save(output, save_all=True, append_images=iter_images(),
+                duration=int(1000.0 / fps), loop=0)
+        elif fmt == '.mp4':
+            subprocess.check_call([ 'ffmpeg', '-y', '-loglevel', 'error',
+                '-framerate', str(fps),
+                '-i', os.path.join(frame_dir, 'frame-%05d.png'),
+                '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                '-pix_fmt', 'yuv420p', output ])
+    finally:
+        pool.close()
+        pool.join()
+        if scratch_dir is not None:
+            shutil.rmtree(scratch_dir)
+
+################################################################################
+### sum_outages: add up the output of any number of `tally-outage.pl` runs,
+###   one file at a time.  Returns arrays indexed by [rack, x, y] of the summed
+###   outage fraction of every node and the number of files that listed it
+def sum_outages( files, config ):
+    linerex = re.compile(r"^(\S+)-(\d+)-(\d+)[ \t]+(\S+)[ \t]*$", re.MULTILINE)
+
+    grid = ( config['rack_xdim'], config['rack_ydim'] )
+    total = np.zeros(( 0, ) + grid)
+    count = np.zeros(( 0, ) + grid, dtype=int)
+
+    for path in files or [ '-' ]:
+        if path == '-':
+            text = sys.stdin.read()
+        else:
+            with open(path, 'r') as fp:
+                text = fp.read()
+
+        fields = np.array(linerex.findall(text), dtype=str).reshape(-1, 4)
+        if not len(fields):
+            continue
+        rack, x, y = node_positions( fields[:, 0], fields[:, 1].astype(int),
+            fields[:, 2].astype(int), config )
+
+        # grow the cluster to hold the highest rack number seen so far
+        if rack.max() >= len(total):
+            n_racks = rack.max() + 1
+            total = np.concatenate(( total,
+                np.zeros(( n_racks - len(total), ) + grid) ))
+            count = np.concatenate(( count,
+                np.zeros(( n_racks - len(count), ) + grid, dtype=int) ))
+
+        np.add.at(total, ( rack, x, y ), fields[:, 3].astype(float))
+        np.add.at(count, ( rack, x, y ), 1)
+
+    return total, count
+
+################################################################################
+### ingest_outage: read the output of `tally-outage.pl` from files (or stdin)
+###   and return racks populated with each node's mean outage fraction
+def ingest_outage( files=None ):
+    total, count = sum_outages( files, config )
 
-    ax = plt.gca()
+    racks = {}
+    for rack in np.flatnonzero(count.any(axis=(1, 2))):
+        racks[str(rack)] = Rack( config, int(rack) )
+        with np.errstate(divide='ignore', invalid='ignore'):
+            racks[str(rack)].loadgrid = np.where(count[rack] > 0,
+                total[rack] / count[rack], -2.0)
+    return racks
+
+################################################################################
+### ingest_and_plot_outage: populate racks as ingest_outage does and draw them
+def ingest_and_plot_outage( ax, files=None ):
+    draw_racks( ax, ingest_outage( files ), config, cm, outage_colors )
+
+################################################################################
+### load_gordon_topology: import gordon-topology.py, which sits next to this
+###   script, and return its GordonTopology for Gordon's layout, cached in
+###   GORDON_TOPOLOGY_CACHE if that is set
+def load_gordon_topology():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'gordon-topology.py')
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('gordon_topology', path)
+        gordon_topology = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(gordon_topology)
+    except ImportError:
+        import imp
+        gordon_topology = imp.load_source('gordon_topology', path)
+    return gordon_topology.GordonTopology.load(
+        cache_file=os.environ.get('GORDON_TOPOLOGY_CACHE'))
+
+################################################################################
+### ion_loads: sum the load and cpus of the up nodes served by each IO node.
+###   Returns a dict of per-ION arrays (load, cpus, ratio of the two, nodes
+###   and down nodes) and an array giving the ION index of every grid cell of
+###   every rack, indexed [rack, slot] like Rack.layout (-1 for cells that are
+###   not Gordon compute nodes)
+def ion_loads( racks, config, topo ):
+    rack_ids = list(racks)
+    load = np.array([ racks[r].loadgrid.ravel() for r in rack_ids ]).reshape(
+        len(rack_ids), -1)
+    cpus = np.array([ racks[r].cpugrid.ravel() for r in rack_ids ]).reshape(
+        len(rack_ids), -1)
+
+    # every grid cell's node name, in the same order as loadgrid.ravel()
+    index = topo.node_index
+    rows, cols = np.indices(( config['rack_xdim'], config['rack_ydim'] ))
+    slots = (10 * (rows + 1) + cols + 1).ravel().tolist()
+    node_id = np.array([ [ index.get('gcn-%d-%d' % ( racks[r].rackid, slot ), -1)
+                           for slot in slots ] for r in rack_ids ],
+                       dtype=int).reshape(len(rack_ids), -1)
+    cell_ion = np.where(node_id >= 0, topo.ions(node_id), -1)
+
+    n_ions = len(topo.ion_names)
+    up = (cell_ion >= 0) & (load >= 0)
+    down = (cell_ion >= 0) & (load > -1.5) & (load < -0.5)
+    ions = {
+        'load':     np.bincount(cell_ion[up], weights=load[up], minlength=n_ions),
+        'cpus':     np.bincount(cell_ion[up], weights=cpus[up], minlength=n_ions),
+        'nodes':    np.bincount(cell_ion[up], minlength=n_ions),
+        'down':     np.bincount(cell_ion[down], minlength=n_ions),
+    }
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ions['ratio'] = np.where(ions['cpus'] > 0, ions['load'] / ions['cpus'],
+                                 0.0)
+    return ions, cell_ion
+
+################################################################################
+### ion_overlay: outline the block of nodes served by each IO node, labelled
+###   with the block's load per cpu.  Blocks at or above threshold are marked
+###   hot.  Returns a dict of per-ION arrays (x, y, width, height, hot, ion)
+###   and a list of label texts, for draw_overlay or render_direct
+def ion_overlay( racks, config, ions, cell_ion, threshold ):
+    nodes, labels = layout_racks( racks, config )
+    node_ion = cell_ion[nodes['rack'], nodes['slot']] if len(cell_ion) \
+        else np.zeros(0, dtype=int)
+    served = node_ion >= 0
+    node_ion = node_ion[served]
+
+    n_ions = len(ions['load'])
+    x0 = np.full(n_ions, np.inf)
+    y0 = np.full(n_ions, np.inf)
+    x1 = np.full(n_ions, -np.inf)
+    y1 = np.full(n_ions, -np.inf)
+    np.minimum.at(x0, node_ion, nodes['x'][served])
+    np.minimum.at(y0, node_ion, nodes['y'][served])
+    np.maximum.at(x1, node_ion, (nodes['x'] + nodes['width'])[served])
+    np.maximum.at(y1, node_ion, (nodes['y'] + nodes['height'])[served])
+
+    shown = np.flatnonzero(np.isfinite(x0))
+    overlay = {
+        'x':        x0[shown],
+        'y':        y0[shown],
+        'width':    (x1 - x0)[shown],
+        'height':   (y1 - y0)[shown],
+        'hot':      ions['ratio'][shown] >= threshold,
+        'ion':      shown,
+    }
+    texts = [ '%d%%' % round(100.0 * ratio) for ratio in ions['ratio'][shown] ]
+    return overlay, texts
+
+################################################################################
+### draw_overlay: draw the block outlines from ion_overlay with matplotlib
+def draw_overlay( ax, overlay, texts ):
+    from matplotlib.collections import PolyCollection
+    edges = [ 'red' if hot else 'black' for hot in overlay['hot'] ]
+    ax.add_collection( PolyCollection( node_vertices( overlay ),
+        facecolors='none', edgecolors=edges, linewidths=2.5,
+        joinstyle='miter' ) )
+    for x, y, text, edge in zip(overlay['x'], overlay['y'], texts, edges):
+        ax.text(x + 0.15, y + 0.15, text, color=edge, fontsize=7,
+            va='top', fontweight='bold',
+            bbox=dict(facecolor='white', edgecolor='none', pad=0.5))
+
+################################################################################
+### print_ion_report: list the IO nodes whose clients' load per cpu is at or
+###   above threshold, busiest first
+def print_ion_report( ions, topo, threshold ):
+    hot = np.flatnonzero(ions['ratio'] >= threshold)
+    hot = hot[np.argsort(-ions['ratio'][hot], kind='mergesort')]
+    for ion in hot:
+        sys.stdout.write('%-10s (%s)  load %7.1f on %4d cpus  %5.1f%%  '
+            '%2d nodes up, %d down\n' % ( topo.ion_names[ion],
+            ', '.join([ str(c) for c in topo.ion_coords[ion] ]),
+            ions['load'][ion], ions['cpus'][ion], 100.0 * ions['ratio'][ion],
+            ions['nodes'][ion], ions['down'][ion] ))
+
+################################################################################
+### draw_ion_torus: draw every IO node at its torus coordinates, one panel per
+###   position along the last dimension, shaded by its clients' load per cpu
+###   and outlined in red if at or above threshold
+def draw_ion_torus( ions, topo, threshold, output ):
+    fig, ax = new_axes()
+    fig.set_size_inches(12, 3.5)
+    size = topo.torus_size
+    coords = topo.array('ion_coords')
+
+    # lay the panels out side by side, a gap of one cell apart
+    x = coords[:, -1] * (size[0] + 1) + coords[:, 0]
+    y = coords[:, 1] if len(size) > 2 else np.zeros(len(coords))
+    cells = { 'x': x.astype(float), 'y': y.astype(float),
+              'width': np.ones(len(x)), 'height': np.ones(len(x)) }
+    hot = ions['ratio'] >= threshold
+
+    from matplotlib.collections import PolyCollection
+    ax.add_collection( PolyCollection( node_vertices( cells ),
+        facecolors=cm(ions['ratio']),
+        edgecolors=[ 'red' if h else 'black' for h in hot ],
+        linewidths=[ 2.5 if h else 1.0 for h in hot ], joinstyle='miter' ) )
+    for i in range(len(x)):
+        ax.text(x[i] + 0.5, y[i] + 0.5, '%s\n%d%%' % ( topo.ion_names[i],
+            round(100.0 * ions['ratio'][i]) ), fontsize=5, ha='center',
+            va='center', color='white' if ions['ratio'][i] > 0.6 else 'black')
+    for z in range(size[-1]):
+        ax.text(z * (size[0] + 1), -0.2, 'z = %d' % z)
 
-    ingest_and_plot_load( ax )
-#   ingest_and_plot_outage( ax )
+    ax.autoscale_view()
+    ax.invert_yaxis()
+    fig.savefig(output, bbox_inches='tight')
+
+################################################################################
+### render_direct: draw racks straight to an SVG or (with Pillow) PNG file,
+###   without matplotlib.  Node and label positions are scaled to scale pixels
+###   per unit of the layout, with y growing downwards as in the matplotlib plot.
+###   overlay and texts, from ion_overlay, are drawn on top if given
+def render_direct( racks, config, output, colors=node_colors, scale=10.0,
+                   overlay=None, texts=None ):
+    nodes, labels = layout_racks( racks, config )
+    fills = np.round(colors( nodes['load'], nodes['cpus'], config['ppn'],
+                             cm )[:, :3] * 255).astype(int)
+
+    # leave room above the topmost labels and around the edges
+    margin = 4.0
+    font_size = 12
+    if len(nodes['x']):
+        x_min = min(nodes['x'].min(), min([ x for x, y, text in labels ]))
+        y_min = min(nodes['y'].min(), min([ y for x, y, text in labels ]))
+        x_max = (nodes['x'] + nodes['width']).max()
+        y_max = (nodes['y'] + nodes['height']).max()
+    else:
+        x_min = y_min = x_max = y_max = 0.0
+    x0 = (nodes['x'] - x_min) * scale + margin
+    y0 = (nodes['y'] - y_min) * scale + margin + font_size
+    x1 = x0 + nodes['width'] * scale
+    y1 = y0 + nodes['height'] * scale
+    width = int(np.ceil((x_max - x_min) * scale + 2 * margin + 4 * font_size))
+    height = int(np.ceil((y_max - y_min) * scale + 2 * margin + font_size))
+    label_xy = [ ( (x - x_min) * scale + margin,
+                   (y - y_min) * scale + margin + font_size, text )
+                 for x, y, text in labels ]
+    outlines = []
+    if overlay is not None:
+        ox = (overlay['x'] - x_min) * scale + margin
+        oy = (overlay['y'] - y_min) * scale + margin + font_size
+        outlines = list(zip(ox, oy, ox + overlay['width'] * scale,
+            oy + overlay['height'] * scale,
+            [ 'red' if hot else 'black' for hot in overlay['hot'] ], texts))
+
+    if output.lower().endswith('.svg'):
+        with open(output, 'w') as fp:
+            fp.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" '
+                'height="%d" viewBox="0 0 %d %d">\n' % ( width, height,
+                width, height ))
+            fp.write('<rect width="100%" height="100%" fill="white"/>\n')
+            fp.write('<g stroke="black" stroke-width="1">\n')
+            fp.write(''.join([ '<rect x="%.1f" y="%.1f" width="%.1f" '
+                'height="%.1f" fill="#%02x%02x%02x"/>\n' % node
+                for node in zip(x0, y0, x1 - x0, y1 - y0,
+                                fills[:, 0], fills[:, 1], fills[:, 2]) ]))
+            fp.write('</g>\n<g font-family="sans-serif" font-size="%d">\n'
+                % font_size)
+            fp.write(''.join([ '<text x="%.1f" y="%.1f">%s</text>\n' % label
+                for label in label_xy ]))
+            fp.write('</g>\n')
+            for ox0, oy0, ox1, oy1, edge, text in outlines:
+                fp.write('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" '
+                    'fill="none" stroke="%s" stroke-width="3"/>\n'
+                    % ( ox0, oy0, ox1 - ox0, oy1 - oy0, edge ))
+                fp.write('<rect x="%.1f" y="%.1f" width="%.1f" height="10" '
+                    'fill="white"/>\n' % ( ox0 + 2, oy0 + 2, 6 * len(text) ))
+                fp.write('<text x="%.1f" y="%.1f" font-family="sans-serif" '
+                    'font-size="9" font-weight="bold" fill="%s">%s</text>\n'
+                    % ( ox0 + 3, oy0 + 10, edge, text ))
+            fp.write('</svg>\n')
+    else:
+        from PIL import Image, ImageDraw
+        image = Image.new('RGB', ( width, height ), 'white')
+        draw = ImageDraw.Draw(image)
+        for box in zip(np.round(x0).astype(int), np.round(y0).astype(int),
+                       np.round(x1).astype(int), np.round(y1).astype(int),
+                       fills[:, 0], fills[:, 1], fills[:, 2]):
+            draw.rectangle(box[:4], fill=tuple(box[4:]), outline='black')
+        for x, y, text in label_xy:
+            draw.text(( x, y - font_size ), text, fill='black')
+        for ox0, oy0, ox1, oy1, edge, text in outlines:
+            draw.rectangle(( int(round(ox0)), int(round(oy0)),
+                int(round(ox1)), int(round(oy1)) ), outline=edge, width=3)
+            box = draw.textbbox(( ox0 + 4, oy0 + 3 ), text)
+            draw.rectangle(( box[0] - 1, box[1] - 1, box[2] + 1, box[3] + 1 ),
+                fill='white')
+            draw.text(( ox0 + 4, oy0 + 3 ), text, fill=edge)
+        image.save(output)
+
+################################################################################
+### blues: the 'Blues' colormap, matching matplotlib's.  Values from 0 to 1
+###   are mapped onto 256 colors interpolated between ColorBrewer's nine Blues;
+###   values outside that range get the end colors, and NaN is transparent
+_BLUES = [ 0xf7fbff, 0xdeebf7, 0xc6dbef, 0x9ecae1, 0x6baed6,
+           0x4292c6, 0x2171b5, 0x08519c, 0x08306b ]
+_BLUES_LUT = np.ones((256, 4))
+for channel, shift in enumerate(( 16, 8, 0 )):
+    _BLUES_LUT[:, channel] = np.interp(np.linspace(0.0, 1.0, 256),
+        np.linspace(0.0, 1.0, len(_BLUES)),
+        [ ((color >> shift) & 0xff) / 255.0 for color in _BLUES ])
+
+def blues( values ):
+    index = np.array(values, dtype=float) * len(_BLUES_LUT)
+    bad = np.isnan(index)
+    index = np.clip(np.where(bad, 0, index), 0, len(_BLUES_LUT) - 1)
+    colors = _BLUES_LUT[index.astype(int)]
+    colors[bad] = 0.0
+    return colors
+
+################################################################################
+### system geometry and colormap, also needed by --replay's pool workers
+config = get_sys_config()
+cm = blues
+
+################################################################################
+### functions timed as phases by --profile
+_PROFILED = [ 'read_nodeview', 'read_pbsnodes', 'read_load', 'ingest_load',
+    'ingest_and_plot_load', 'sum_outages', 'ingest_outage',
+    'ingest_and_plot_outage', 'layout_racks', 'node_colors', 'outage_colors',
+    'node_vertices', 'draw_racks', 'new_axes', 'load_gordon_topology',
+    'ion_loads', 'ion_overlay', 'draw_overlay', 'draw_ion_torus',
+    'render_direct', 'parse_snapshot', 'init_frame_renderer', 'render_frame',
+    'replay_snapshots' ]
+
+################################################################################
+### main function
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Draw the load on every node laid out by rack')
+    parser.add_argument('files', nargs='*',
+        help='nodeview --nocolor output or pbsnodes -x XML, or with --outage '
+             'tally-outage.pl output (default: stdin)')
+    parser.add_argument('--outage', action='store_true',
+        help='draw the mean fraction of time each node was down or offline '
+             'over every tally-outage.pl output given')
+    parser.add_argument('--ions', action='store_true',
+        help='Gordon only: outline the nodes served by each IO node with '
+             'their total load per cpu, and list the busiest IO nodes')
+    parser.add_argument('--ion-threshold', type=float, default=0.9,
+        metavar='RATIO', help='load per cpu at which --ions marks an IO node '
+                              'hot (default: 0.9)')
+    parser.add_argument('--torus', action='store_true',
+        help='with --ions, also draw the IO nodes at their torus coordinates '
+             'in OUTPUT-torus.png (needs the matplotlib backend)')
+    parser.add_argument('--pbsnodes', nargs='?', const='pbsnodes',
+        metavar='PATH', help='run pbsnodes -x (optionally at PATH) and draw '
+                             'its output instead of reading files')
+    parser.add_argument('--replay', metavar='SOURCE',
+        help='render every nodeview or pbsnodes snapshot in a directory or '
+             'tarball')
+    parser.add_argument('-o', '--output', metavar='OUTPUT',
+        help='image to write (default: %s-load.png, or %s-outage.png with '
+             '--outage); with --replay a directory of frames, or a .gif or '
+             '.mp4 file (default: %s-load.gif)' % (( config['system'], ) * 3))
+    parser.add_argument('--backend', default='matplotlib',
+        choices=[ 'matplotlib', 'direct' ],
+        help='draw with matplotlib, or write an .svg or .png directly, which '
+             'is much faster to start (default: matplotlib)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='worker processes for --replay (default: one per core)')
+    parser.add_argument('--fps', type=float, default=10,
+        help='--replay frames per second (default: 10)')
+    phase_profile.add_arguments(parser)
+    try:
+        profiler, argv = phase_profile.from_argv(sys.argv)
+    except ValueError as e:
+        parser.error(str(e))
+    args = parser.parse_args(argv[1:])
+    profiler.instrument(globals(), _PROFILED)
+
+    if args.replay:
+        try:
+            replay_snapshots( args.replay,
+                args.output or '%s-load.gif' % config['system'],
+                args.jobs, args.fps )
+        except (IOError, OSError, ValueError, tarfile.TarError,
+                subprocess.CalledProcessError) as e:
+            sys.stderr.write('%s\n' % e)
+            sys.exit(1)
+        sys.exit(0)
+
+    try:
+        if args.outage:
+            racks = ingest_outage( args.files )
+            colors = outage_colors
+        else:
+            racks = ingest_load( args.files, args.pbsnodes )
+            colors = node_colors
+    except (IOError, OSError, ElementTree.ParseError) as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
+    output = args.output or '%s-%s.png' % ( config['system'],
+        'outage' if args.outage else 'load' )
+
+    overlay = texts = None
+    if args.ions:
+        if config['system'] != 'gordon' or args.outage:
+            parser.error('--ions needs Gordon load data')
+        topo = load_gordon_topology()
+        ions, cell_ion = ion_loads( racks, config, topo )
+        overlay, texts = ion_overlay( racks, config, ions, cell_ion,
+            args.ion_threshold )
+        print_ion_report( ions, topo, args.ion_threshold )
+        if args.torus:
+            base, ext = os.path.splitext(output)
+            draw_ion_torus( ions, topo, args.ion_threshold,
+                base + '-torus' + (ext or '.png') )
+
+    if args.backend == 'direct':
+        render_direct( racks, config, output, colors, overlay=overlay,
+            texts=texts )
+        sys.exit(0)
+
+    ### initialize the plot
+    fig, ax = new_axes()
+    draw_racks( ax, racks, config, cm, colors )
+    if overlay is not None:
+        draw_overlay( ax, overlay, texts )
 
     ax.autoscale_view()
     ax.invert_yaxis()
 #   plt.show()
-    plt.savefig('%s-load.png' % config['system'], bbox_inches='tight')
+    with profiler.phase('savefig'):
+        fig.savefig(output, bbox_inches='tight')
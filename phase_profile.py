@@ -0,0 +1,342 @@
+#
+#  phase_profile.py: shared --profile support for gordon-topology.py,
+#    dragonfly-topology.py and load-vis.py.  Records the wall time and number
+#    of calls of named phases of a run and appends them to a file as JSON
+#    lines, one per phase, optionally with each phase's peak memory and
+#    alongside a cProfile dump.
+#
+#    --profile FILE     append phase timings to FILE ('-' for stderr)
+#    --profile-memory   also record each phase's peak memory (slows the run)
+#    --cprofile FILE    also write cProfile statistics of the main process to
+#                       FILE (for pstats)
+#
+#  Phases are either blocks of code wrapped in `with profiler.phase(name):` or
+#  module functions replaced by timed wrappers with profiler.instrument().
+#  Work handed to a phase_profile.Pool is timed in its worker processes and
+#  added to the same phases, so a phase's wall_s is summed over processes and
+#  may be more than the run's total.
+#  The high-water mark of the process and any pool workers it has waited for
+#  is reported as maxrss_kb on every line.  With --profile-memory, peak_kb is
+#  what tracemalloc sees allocated during the phase (NumPy arrays included),
+#  null before Python 3.9 where tracemalloc can't measure it per phase.
+#  Tracing every allocation makes allocation-heavy code several times slower,
+#  so wall_s is only representative of production runs without it.
+#
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import timeit
+
+try:
+    import tracemalloc
+    if not hasattr(tracemalloc, 'reset_peak'):    # before Python 3.9
+        tracemalloc = None
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_active = None      # the PhaseProfiler of this run, if there is one
+_pool_class = None  # the class behind Pool, defined on first use
+
+class PhaseProfiler(object):
+    """
+    Accumulates per-phase wall time, call counts and, if memory is set, peak
+    memory for one run of script, and writes them when the program exits
+    """
+
+    def __init__(self, script, profile_file, cprofile_file=None, memory=False):
+        self.script = os.path.basename(script)
+        self.profile_file = profile_file
+        self.cprofile_file = cprofile_file
+        self.memory = memory
+        self.tracemalloc = tracemalloc if memory else None
+        self.phases = {}        # name -> [ calls, wall seconds, peak bytes ]
+        self.order = []
+        self.stack = []         # [ name, start memory, highest memory seen ]
+        self.start = timeit.default_timer()
+        self.cprofile = None
+        self.base = self.highest = 0
+        self.reported = {}      # name -> [ calls, wall seconds ] sent so far
+
+        if self.tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.base = self.highest = tracemalloc.get_traced_memory()[0]
+        if cprofile_file:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        atexit.register(self.close)
+        global _active
+        _active = self
+
+    def phase(self, name):
+        'Context manager timing the enclosed block as the named phase'
+        return _Phase(self, name)
+
+    def enter(self, name):
+        if self.tracemalloc is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1][2] = max(self.stack[-1][2], peak)
+            self.highest = max(self.highest, peak)
+            tracemalloc.reset_peak()
+            self.stack.append([ name, current, current ])
+        else:
+            self.stack.append([ name, 0, 0 ])
+        return timeit.default_timer()
+
+    def leave(self, name, started):
+        wall = timeit.default_timer() - started
+        frame = self.stack.pop()
+        peak = None
+        if self.tracemalloc is not None:
+            highest = max(frame[2], tracemalloc.get_traced_memory()[1])
+            peak = highest - frame[1]
+            # the enclosing phase saw this phase's high-water mark too
+            if self.stack:
+                self.stack[-1][2] = max(self.stack[-1][2], highest)
+            self.highest = max(self.highest, highest)
+            tracemalloc.reset_peak()
+
+        self.add(name, 1, wall, peak)
+
+    def add(self, name, calls, wall, peak):
+        'Adds calls to a phase taking wall seconds and at most peak bytes'
+        if name not in self.phases:
+            self.phases[name] = [ 0, 0.0, None ]
+            self.order.append(name)
+        record = self.phases[name]
+        record[0] += calls
+        record[1] += wall
+        if peak is not None:
+            record[2] = peak if record[2] is None else max(record[2], peak)
+
+    def start_worker(self):
+        """
+        Forgets the phases copied from the parent when this process was forked
+        as a pool worker, so that only the worker's own are reported
+        """
+        self.phases = {}
+        self.order = []
+        self.stack = []
+        self.reported = {}
+        self.profile_file = None
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile = None
+
+    def unreported(self):
+        """
+        Returns ( name, calls, wall, peak ) for the calls of every phase since
+        the last time this was called
+        """
+        records = []
+        for name in self.order:
+            calls, wall, peak = self.phases[name]
+            sent = self.reported.get(name, [ 0, 0.0 ])
+            if calls > sent[0]:
+                records.append(( name, calls - sent[0], wall - sent[1], peak ))
+                self.reported[name] = [ calls, wall ]
+        return records
+
+    def instrument(self, namespace, names):
+        """
+        Replaces each named function in namespace (a module's globals()) with
+        a wrapper that times every call as a phase of the same name
+        """
+        for name in names:
+            namespace[name] = self.timed(namespace[name], name)
+
+    def timed(self, func, name=None):
+        'Returns func wrapped so that each call is timed as a phase'
+        name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = self.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.leave(name, started)
+        return wrapper
+
+    def close(self):
+        'Writes the phases recorded so far; called automatically at exit'
+        if self.profile_file is None:
+            return
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_file)
+
+        maxrss = None
+        if resource is not None:
+            # the largest of this process and its finished pool workers
+            maxrss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            if sys.platform == 'darwin':
+                maxrss //= 1024
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+        lines = []
+        records = [ ( name, ) + tuple(self.phases[name]) for name in self.order ]
+        total_peak = None
+        if self.tracemalloc is not None:
+            total_peak = max(self.highest,
+                             tracemalloc.get_traced_memory()[1]) - self.base
+        records.append(( 'total', 1, timeit.default_timer() - self.start,
+                         total_peak ))
+        for name, calls, wall, peak in records:
+            line = {
+                'time':         stamp,
+                'pid':          os.getpid(),
+                'script':       self.script,
+                'phase':        name,
+                'calls':        calls,
+                'wall_s':       round(wall, 6),
+                'maxrss_kb':    maxrss }
+            if self.memory:
+                line['peak_kb'] = None if peak is None \
+                    else round(peak / 1024.0, 1)
+            lines.append(json.dumps(line, sort_keys=True))
+
+        if self.profile_file == '-':
+            sys.stderr.write('\n'.join(lines) + '\n')
+        else:
+            with open(self.profile_file, 'a') as fp:
+                fp.write('\n'.join(lines) + '\n')
+        self.profile_file = None
+
+def Pool(processes=None, initializer=None, initargs=()):
+    """
+    A multiprocessing pool whose imap adds the phases timed in its workers
+    to this run's PhaseProfiler, when there is one.  multiprocessing is only
+    imported here, so that runs that never start a pool don't wait for it
+    """
+    global _pool_class
+    if _pool_class is None:
+        import multiprocessing.pool
+
+        class _ProfiledPool(multiprocessing.pool.Pool):
+            def __init__(self, processes=None, initializer=None, initargs=()):
+                multiprocessing.pool.Pool.__init__(self, processes,
+                    _start_worker, ( initializer, initargs ))
+
+            def imap(self, func, iterable, chunksize=1):
+                if _active is None:
+                    return multiprocessing.pool.Pool.imap(self, func,
+                                                          iterable, chunksize)
+                profiler = _active
+                results = multiprocessing.pool.Pool.imap(self,
+                    _WorkerTask(func), iterable, chunksize)
+                def merged():
+                    for result, records in results:
+                        for record in records:
+                            profiler.add(*record)
+                        yield result
+                return merged()
+
+        _pool_class = _ProfiledPool
+    return _pool_class(processes, initializer, initargs)
+
+def _start_worker(initializer, initargs):
+    if _active is not None:
+        _active.start_worker()
+    if initializer is not None:
+        initializer(*initargs)
+
+class _WorkerTask(object):
+    'Runs func in a pool worker and returns its result with the new phases'
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, arg):
+        result = self.func(arg)
+        if _active is None:
+            return result, []
+        return result, _active.unreported()
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = self.profiler.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.leave(self.name, self.started)
+        return False
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NullProfiler(object):
+    'Stands in for PhaseProfiler when --profile is not given'
+
+    def phase(self, name):
+        return _NullPhase()
+
+    def instrument(self, namespace, names):
+        pass
+
+    def timed(self, func, name=None):
+        return func
+
+    def close(self):
+        pass
+
+def add_arguments(parser):
+    """
+    Documents --profile, --profile-memory and --cprofile in an argparse
+    parser's help; the options themselves are taken out of argv by from_argv
+    before parsing
+    """
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--profile', metavar='FILE',
+        help="append each phase's wall time and calls to FILE as JSON lines "
+             "('-' for stderr)")
+    group.add_argument('--profile-memory', action='store_true',
+        help="also record each phase's peak memory with tracemalloc, which "
+             "slows the run down")
+    group.add_argument('--cprofile', metavar='FILE',
+        help='also write cProfile statistics to FILE')
+
+def from_argv(argv):
+    """
+    Removes --profile FILE, --profile-memory and --cprofile FILE from a copy
+    of argv.  Returns ( profiler, remaining argv ), where profiler is a
+    PhaseProfiler if any of them was given and a NullProfiler otherwise.
+    Raises ValueError if --profile or --cprofile lacks its FILE
+    """
+    argv = list(argv)
+    memory = '--profile-memory' in argv
+    while '--profile-memory' in argv:
+        argv.remove('--profile-memory')
+    files = {}
+    for option in ( '--profile', '--cprofile' ):
+        while option in argv:
+            i = argv.index(option)
+            if i + 1 >= len(argv):
+                raise ValueError('%s needs a file name' % option)
+            files[option] = argv[i + 1]
+            del argv[i:i + 2]
+
+    if not files and not memory:
+        return NullProfiler(), argv
+    if '--profile' not in files:
+        files['--profile'] = '-'
+    return PhaseProfiler(argv[0], files['--profile'],
+                         files.get('--cprofile'), memory), argv
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+#  Benchmark gordon-topology.py, dragonfly-topology.py and load-vis.py on
+#  synthetic inputs of increasing size, and write the timings as JSON so that
+#  runs from different versions can be compared (--compare).
+#
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import timeit
+import numpy as np
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+### load_script: import one of the hyphenated scripts next to this one as a
+###   module, with anything it prints while loading discarded
+def load_script(filename, module_name):
+    path = os.path.join(_HERE, filename)
+    saved = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        try:
+            import importlib.util
+            spec = importlib.util.spec_from_file_location(module_name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            spec.loader.exec_module(module)
+        except ImportError:
+            import imp
+            module = imp.load_source(module_name, path)
+    finally:
+        sys.stdout.close()
+        sys.stdout, sys.stderr = saved
+    return module
+
+### quiet: call func(*args) with its stdout discarded
+def quiet(func, *args):
+    saved = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return func(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+
+### with_open_files: call func(*args) with the soft limit on open files
+###   lowered to limit (where the platform has one)
+def with_open_files(limit, func, *args):
+    try:
+        import resource
+    except ImportError:
+        return func(*args)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < limit:
+        limit = soft
+    resource.setrlimit(resource.RLIMIT_NOFILE, ( limit, hard ))
+    try:
+        return func(*args)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, ( soft, hard ))
+
+### have_module: whether a module is installed, without importing it
+def have_module(name):
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return False
+        return True
+    return importlib.util.find_spec(name) is not None
+
+### time_call: run func(*args) repeat times and return the best and mean wall
+###   times in seconds
+def time_call(repeat, func, *args):
+    times = []
+    for i in range(repeat):
+        start = timeit.default_timer()
+        func(*args)
+        times.append(timeit.default_timer() - start)
+    return min(times), sum(times) / len(times)
+
+### synthetic_nodeview: nodeview --nocolor output for n_nodes Gordon-style
+###   nodes (gcn-RACK-RC, 64 to a rack) with random loads and states
+def synthetic_nodeview(n_nodes, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n_nodes):
+        rack = i // 64 + 1
+        slot = 10 * (i % 64 // 8 + 1) + i % 8 + 1
+        state = 'down' if rng.random() < 0.02 else 'job-exclusive'
+        lines.append("%-14s %4d %4d %4d  %7s  %6.1fG %6.1f%% %7.2f %-15.15s\n"
+            % ( 'gcn-%d-%d' % ( rack, slot ), 1, 16, 16, '16/16', 64.0,
+                rng.random() * 100.0, rng.random() * 20.0, state ))
+    return ''.join(lines)
+
+### bench_gordon: time building Gordon's topology, loading it with and without
+###   a cache file, and hop distributions for node lists of each size (nodes
+###   may repeat, as ranks do)
+def bench_gordon(sizes, repeat, scratch):
+    gt = load_script('gordon-topology.py', 'gordon_topology')
+    topo_params = gt.get_topo_params()
+    best, mean = time_call(repeat, gt.get_gordon_topology, topo_params)
+    yield 'gordon.get_gordon_topology', topo_params['total_computes'], \
+        'nodes', best, mean
+
+    best, mean = time_call(repeat, gt.GordonTopology.load, topo_params)
+    yield 'gordon.GordonTopology.load', topo_params['total_computes'], \
+        'nodes', best, mean
+    cache_file = os.path.join(scratch, 'gordon.cache')
+    gt.GordonTopology.load(topo_params, cache_file)
+    best, mean = time_call(repeat, gt.GordonTopology.load, topo_params,
+                           cache_file)
+    yield 'gordon.GordonTopology.load_cached', topo_params['total_computes'], \
+        'nodes', best, mean
+
+    topo = gt.GordonTopology.load(topo_params)
+    names = sorted(topo.node_names)
+    rng = random.Random(1)
+    for size in sizes:
+        node_list = [ rng.choice(names) for i in range(size) ]
+        best, mean = time_call(repeat, quiet, gt.calculate_hop_distribution,
+                               node_list, topo)
+        yield 'gordon.calculate_hop_distribution', size, 'nodes', best, mean
+
+### bench_dragonfly: time building and printing dragonfly systems of each
+###   number of groups
+def bench_dragonfly(groups, repeat):
+    df = load_script('dragonfly-topology.py', 'dragonfly_topology')
+    for n_groups in groups:
+        params = df.get_dragonfly_params(groups_per_system=n_groups)
+        best, mean = time_call(repeat, df.build_dragonfly, params)
+        yield 'dragonfly.build_dragonfly', n_groups, 'groups', best, mean
+
+        def dotfile():
+            with open(os.devnull, 'w') as out:
+                df.print_dotfile(df.iter_dragonfly(params), out)
+        best, mean = time_call(repeat, dotfile)
+        yield 'dragonfly.print_dotfile', n_groups, 'groups', best, mean
+
+### bench_load_vis: time parsing nodeview snapshots of each cluster size and
+###   rendering them with the direct and (if installed) matplotlib backends,
+###   then replaying a directory of one-rack snapshots of each length as a GIF.
+###   Replays run with fewer open files allowed than the longest has frames,
+###   so that one holding every frame open fails here rather than only on a
+###   long enough day
+def bench_load_vis(sizes, replays, repeat, scratch):
+    lv = load_script('load-vis.py', 'load_vis')
+    config = lv.get_sys_config('gordon')
+    for size in sizes:
+        text = synthetic_nodeview(size)
+        best, mean = time_call(repeat, lv.read_load, text, config)
+        yield 'load_vis.read_load', size, 'nodes', best, mean
+
+        racks = lv.read_load(text, config)
+        # the direct backend writes PNG with Pillow, and SVG with nothing
+        for ext in ( 'svg', 'png' ) if have_module('PIL') else ( 'svg', ):
+            output = os.path.join(scratch, 'bench.%s' % ext)
+            best, mean = time_call(repeat, lv.render_direct, racks, config,
+                                   output)
+            yield 'load_vis.render_direct_%s' % ext, size, 'nodes', best, mean
+
+        if not have_module('matplotlib'):
+            continue
+        def render_matplotlib():
+            fig, ax = lv.new_axes()
+            lv.draw_racks(ax, racks, config, lv.cm)
+            ax.autoscale_view()
+            ax.invert_yaxis()
+            fig.savefig(os.path.join(scratch, 'bench.png'), bbox_inches='tight')
+            import matplotlib.pyplot as plt
+            plt.close(fig)
+        best, mean = time_call(repeat, render_matplotlib)
+        yield 'load_vis.render_matplotlib', size, 'nodes', best, mean
+
+    if not ( have_module('matplotlib') and have_module('PIL') ):
+        return
+    lv.config = config           # what the replay pool workers parse with
+    for n_frames in replays:
+        snapshots = os.path.join(scratch, 'snapshots')
+        os.mkdir(snapshots)
+        try:
+            for i in range(n_frames):
+                with open(os.path.join(snapshots, 'nodeview-%05d.txt' % i),
+                          'w') as fp:
+                    fp.write(synthetic_nodeview(64, seed=i))
+            best, mean = time_call(1, with_open_files, 256,
+                lv.replay_snapshots, snapshots,
+                os.path.join(scratch, 'bench.gif'))
+        finally:
+            for filename in os.listdir(snapshots):
+                os.unlink(os.path.join(snapshots, filename))
+            os.rmdir(snapshots)
+        yield 'load_vis.replay_snapshots_gif', n_frames, 'frames', best, mean
+
+### print_comparison: print each benchmark's best time next to the same
+###   benchmark in a baseline results file
+def print_comparison(results, baseline):
+    old = dict([ (( r['name'], r['size'] ), r['best'])
+                 for r in baseline['results'] ])
+    print( "%-38s %8s %11s %11s %8s" % ( 'benchmark', 'size', 'baseline',
+        'current', 'ratio' ), file=sys.stderr )
+    for r in results:
+        before = old.get(( r['name'], r['size'] ))
+        if before:
+            print( "%-38s %8d %10.4fs %10.4fs %7.2fx" % ( r['name'], r['size'],
+                before, r['best'], r['best'] / before ), file=sys.stderr )
+        else:
+            print( "%-38s %8d %11s %10.4fs" % ( r['name'], r['size'], '-',
+                r['best'] ), file=sys.stderr )
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0],
+        description='Benchmark the topology and visualization tools on '
+                    'synthetic inputs')
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help='write JSON results to FILE instead of stdout')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='runs of each benchmark; the best is reported (default: 3)')
+    parser.add_argument('--quick', action='store_true',
+        help='only run the smaller input sizes')
+    parser.add_argument('--only', metavar='SUITE', action='append',
+        choices=[ 'gordon', 'dragonfly', 'load_vis' ],
+        help='run only this suite (may be repeated)')
+    parser.add_argument('--compare', metavar='FILE',
+        help='print how each timing compares with an earlier results FILE')
+    options = parser.parse_args(argv[1:])
+
+    if options.quick:
+        node_lists = [ 16, 256, 1024 ]
+        groups = [ 2, 5 ]
+        clusters = [ 1000 ]
+        replays = [ 20 ]
+    else:
+        node_lists = [ 16, 256, 1024, 10000, 100000 ]
+        groups = [ 2, 5, 12, 34, 96 ]
+        clusters = [ 1000, 10000, 50000 ]
+        # more frames than bench_load_vis lets a replay have files open
+        replays = [ 20, 1100 ]
+
+    scratch = os.path.join(os.environ.get('TMPDIR', '/tmp'),
+                           'topology-bench-%d' % os.getpid())
+    os.makedirs(scratch)
+    suites = [
+        ( 'gordon', lambda: bench_gordon(node_lists, options.repeat,
+                                         scratch) ),
+        ( 'dragonfly', lambda: bench_dragonfly(groups, options.repeat) ),
+        ( 'load_vis', lambda: bench_load_vis(clusters, replays,
+                                             options.repeat, scratch) ),
+    ]
+
+    results = []
+    try:
+        for suite, run in suites:
+            if options.only and suite not in options.only:
+                continue
+            for name, size, unit, best, mean in run():
+                results.append({ 'name': name, 'size': size, 'unit': unit,
+                                 'best': round(best, 6), 'mean': round(mean, 6),
+                                 'repeat': options.repeat })
+                print( "%-38s %8d %-6s %10.4fs" % ( name, size, unit, best ),
+                    file=sys.stderr )
+    finally:
+        for filename in os.listdir(scratch):
+            os.unlink(os.path.join(scratch, filename))
+        os.rmdir(scratch)
+
+    report = {
+        'timestamp':    time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host':         socket.gethostname(),
+        'python':       platform.python_version(),
+        'numpy':        np.__version__,
+        'results':      results,
+    }
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(report, fp, indent=1, sort_keys=True)
+            fp.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if options.compare:
+        with open(options.compare, 'r') as fp:
+            print_comparison(results, json.load(fp))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,175 @@
+#
+#  topology.py: the interface shared by gordon-topology.py's GordonTopology
+#    and dragonfly-topology.py's DragonflyTopology, and the hop histogram,
+#    node list and graph printers that work on either.
+#
+#  A topology is a set of compute nodes, each attached to one endpoint (an IO
+#  node on Gordon's torus, a router in a dragonfly), and links between the
+#  endpoints.  All nodes behind one endpoint are the same distance from every
+#  other node, so distances are looked up in an endpoint x endpoint hop table
+#  that each topology builds once and then reuses for every query.
+#
+#  NumPy is imported only by the batched queries, so that a tool answering a
+#  query about a few nodes from a small table does not pay to load it.
+#
+
+from __future__ import print_function
+import sys
+
+class Topology(object):
+    """
+    Base class for network topologies.  Subclasses provide
+
+        node_names        compute node names; a node's id is its position
+        node_index        dict of node name -> id
+        endpoint_names    endpoint names; an endpoint's id is its position
+        node_endpoint     sequence of the endpoint id of every node
+        endpoint_links()  ( end1, end2 ) arrays of endpoint ids, one entry
+                          per link or bundle of parallel links
+        endpoint_hops()   endpoint x endpoint array of hop counts, -1 where
+                          there is no path; computed at most once
+
+    and get batched queries on node names or ids from the methods below.
+    Queries read distances through endpoint_rows, which a subclass may
+    override to find only the rows it is asked for
+    """
+
+    __slots__ = ()
+
+    def endpoint_rows(self, endpoints):
+        'Rows of the hop table for an array of endpoint ids'
+        return self.endpoint_hops()[endpoints]
+
+    def endpoint_hop(self, endpoint1, endpoint2):
+        'Hop distance between two endpoint ids (-1 if there is no path)'
+        return int(self.endpoint_rows([ endpoint1 ])[0][endpoint2])
+
+    def endpoint_table(self, endpoints):
+        'Hops between every pair of a list of endpoint ids, as lists of ints'
+        return self.endpoint_rows(endpoints)[:, endpoints].tolist()
+
+    def endpoint_label(self, endpoint):
+        'Text naming an endpoint in print_node_list'
+        return self.endpoint_names[endpoint]
+
+    def node_ids(self, nodes):
+        """
+        Integer ids for a node name, a sequence of names, or an array of names
+        or ids.  Raises KeyError for unknown names
+        """
+        if isinstance(nodes, str):
+            return self.node_index[nodes]
+        import numpy as np
+        nodes = np.asarray(nodes)
+        if nodes.dtype.kind in 'iu':
+            return nodes
+        index = self.node_index
+        return np.array([ index[node] for node in nodes.ravel().tolist() ],
+            dtype=int).reshape(nodes.shape)
+
+    def endpoints(self, nodes):
+        'Endpoint id of each node'
+        if isinstance(nodes, str):
+            return self.node_endpoint[self.node_index[nodes]]
+        import numpy as np
+        return np.asarray(self.node_endpoint)[self.node_ids(nodes)]
+
+    def hops(self, nodes_a, nodes_b):
+        'Hop distances between nodes_a and nodes_b, broadcast elementwise'
+        import numpy as np
+        ends_a, ends_b = np.broadcast_arrays(self.endpoints(nodes_a),
+                                             self.endpoints(nodes_b))
+        sources, inverse = np.unique(ends_a, return_inverse=True)
+        return self.endpoint_rows(sources)[inverse.reshape(ends_a.shape),
+                                           ends_b].astype(int)
+
+    def histogram(self, nodes):
+        """
+        Number of non-redundant node pairs at each hop distance, as a list
+        whose last bin is the largest distance seen.  The pairs between two
+        endpoints are counted at once as the product of their node counts.
+        Raises ValueError if some pair has no path between them
+        """
+        import numpy as np
+        counts = np.bincount(self.endpoints(nodes),
+            minlength=len(self.endpoint_names))
+        used = np.nonzero(counts)[0]
+        counts = counts[used]
+        hops = self.endpoint_rows(used)[:, used]
+        weights = np.outer(counts, counts)
+        np.fill_diagonal(weights, counts * (counts - 1))
+        if (hops[weights > 0] < 0).any():
+            i, j = np.argwhere((hops < 0) & (weights > 0))[0]
+            raise ValueError('No path between %s and %s'
+                % ( self.endpoint_names[used[i]], self.endpoint_names[used[j]] ))
+        histogram = np.bincount(np.maximum(hops, 0).ravel(),
+            weights=weights.ravel()) // 2
+        nonzero = np.nonzero(histogram)[0]
+        return histogram[:nonzero[-1] + 1 if len(nonzero) else 1] \
+            .astype(int).tolist()
+
+    def neighbors(self, endpoint):
+        'Sorted ids of the endpoints linked to an endpoint (a name or id)'
+        import numpy as np
+        if not isinstance(endpoint, (int, np.integer)):
+            endpoint = self.endpoint_names.index(endpoint)
+        end1, end2 = self.endpoint_links()
+        return np.unique(np.concatenate((end2[end1 == endpoint],
+                                         end1[end2 == endpoint])))
+
+    def endpoint_nodes(self):
+        'List, for every endpoint id, of the names of its nodes in id order'
+        endpoint_nodes = [ [] for endpoint in self.endpoint_names ]
+        for name, endpoint in zip(self.node_names, self.node_endpoint):
+            endpoint_nodes[endpoint].append(name)
+        return endpoint_nodes
+
+def print_hop_histogram(histogram, n_nodes, out=None):
+    """
+    Prints a hop histogram, as returned by Topology.histogram, for a list of
+    n_nodes nodes to out (stdout by default)
+    """
+    if out is None:
+        out = sys.stdout
+    out.write( "Max hops: %d\n"  % ( len(histogram) - 1 ) )
+    for index, value in enumerate(histogram):
+        out.write( "%2d hops: %d pairs\n" % ( index, value ) )
+    out.write( "Sum:      %d pairs between %d nodes\n"
+        % ( sum(histogram), n_nodes ) )
+
+def print_node_list(topo, per_row=8, per_group=1, out=None):
+    """
+    Prints every endpoint followed by the nodes attached to it, per_row to a
+    line, with a blank line ahead of each group of per_group endpoints
+    """
+    if out is None:
+        out = sys.stdout
+    for endpoint, nodes in enumerate(topo.endpoint_nodes()):
+        if endpoint % per_group == 0:
+            out.write( "\n" )
+        out.write( "== %s ==\n" % topo.endpoint_label(endpoint) )
+        for first in range(0, len(nodes), per_row):
+            out.write( ''.join([ "%10s" % node
+                                 for node in nodes[first:first+per_row] ])
+                + "\n" )
+
+def print_dot(topo, out=None):
+    """
+    Prints the links between endpoints and from each endpoint to its nodes as
+    dot edges.  Parallel links are printed once, and each link as its two
+    endpoint ids in increasing order, sorted
+    """
+    import numpy as np
+    if out is None:
+        out = sys.stdout
+    n_endpoints = len(topo.endpoint_names)
+    end1, end2 = topo.endpoint_links()
+    keys = np.unique(np.minimum(end1, end2) * n_endpoints
+                     + np.maximum(end1, end2))
+    names = topo.endpoint_names
+    for first, second in zip((keys // n_endpoints).tolist(),
+                             (keys % n_endpoints).tolist()):
+        out.write( '"%s" -- "%s";\n' % ( names[first], names[second] ) )
+    for endpoint, nodes in enumerate(topo.endpoint_nodes()):
+        for node in nodes:
+            out.write( '"%s" -- "%s";\n' % ( names[endpoint], node ) )
@@ -0,0 +1,53 @@
+#
+#  torque_xml.py: incremental parsing of the XML printed by Torque's qstat -x
+#    and pbsnodes -x, shared by gordon-topology.py and load-vis.py.
+#
+#  Torque copies job and node attributes into its XML without escaping them,
+#  so a single job named a&b makes a whole qstat -x dump unparseable.  The
+#  files are read through EscapedXML, which escapes such bare ampersands as
+#  it goes and leaves the entity and character references alone.
+#
+
+import re
+import xml.etree.ElementTree as ElementTree
+
+# an & that does not start an entity or character reference
+_BARE_AMPERSAND = u'&(?!(?:[A-Za-z_][A-Za-z0-9_.-]*|#[0-9]+|#x[0-9A-Fa-f]+);)'
+# a trailing & at most this far from the end of a read may start a reference
+# that the next read completes
+_MAX_REFERENCE = 32
+
+# ( pattern, ampersand, escaped ampersand, semicolon ) for binary and text files
+_BINARY = ( re.compile(_BARE_AMPERSAND.encode('ascii')), b'&', b'&amp;', b';' )
+_TEXT = ( re.compile(_BARE_AMPERSAND), u'&', u'&amp;', u';' )
+
+class EscapedXML(object):
+    """
+    File-like wrapper around an XML file, opened in binary or text mode, that
+    escapes the bare ampersands in what is read from it
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.held = None        # the end of the last read, not yet returned
+
+    def read(self, size=-1):
+        chunk = self.fp.read(size)
+        data = chunk if self.held is None else self.held + chunk
+        self.held = data[:0]
+        pattern, ampersand, escaped, semicolon = \
+            _BINARY if isinstance(data, bytes) else _TEXT
+
+        if chunk and size is not None and size >= 0:
+            # keep back a trailing & whose reference may end in the next read
+            cut = data.rfind(ampersand)
+            if cut >= 0 and len(data) - cut < _MAX_REFERENCE \
+                    and data.find(semicolon, cut) < 0:
+                data, self.held = data[:cut], data[cut:]
+                if not data:
+                    return self.read(size)
+        return pattern.sub(escaped, data)
+
+def iterparse(fp):
+    'ElementTree.iterparse over fp with its bare ampersands escaped'
+    return ElementTree.iterparse(EscapedXML(fp))